@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Checks of conanfile.py coverage helpers against real lcov 1.x.
+
+Unlike run_benchmarks.py these checks need gcc, gcov and lcov (geninfo) on PATH, checks whose tools are missing are
+skipped. Tracefile merge is also checked against fixtures/lcov/test.info, the output lcov 1.x gives for tracefiles of
+the same folder, so that part runs without lcov too. Exit code is 1 if any check failed.
+
+Usage:
+    python benchmarks/check_lcov.py
+    python benchmarks/check_lcov.py --only capture
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+
+import run_benchmarks as rb
+
+conanfile = rb.conanfile
+
+FIXTURES_FOLDER = os.path.join(rb.BENCHMARKS_FOLDER, "fixtures", "lcov")
+
+# Several translation units in one object folder share inline functions of one header, so gcov of every .gcda file
+# writes the same header .gcov file into that folder
+CAPTURE_SOURCES = {
+    "common.h": "static inline int twice(int value)\n"
+                "{\n"
+                "    if (value > 10)\n"
+                "        return value;\n"
+                "    return value * 2;\n"
+                "}\n",
+    "first.c": '#include "common.h"\nint first(int value) { return twice(value) + 1; }\n',
+    "second.c": '#include "common.h"\nint second(int value) { return twice(value + 20); }\n',
+    "third.c": '#include "common.h"\nint third(int value) { return value ? twice(value) : 0; }\n',
+    "main.c": "int first(int); int second(int); int third(int); int fourth(int);\n"
+              "int main(void) { return first(1) + second(2) + third(0) + fourth(3) > 1000; }\n",
+    "other/fourth.c": '#include "../common.h"\nint fourth(int value) { return twice(twice(value)); }\n',
+}
+
+
+class CheckSkipped(Exception):
+    pass
+
+
+def require_tools(*names):
+    missing = [name for name in names if not shutil.which(name)]
+    if missing:
+        raise CheckSkipped("{0} not found".format(", ".join(missing)))
+
+
+def call(command, cwd):
+    process = subprocess.run(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True)
+    if process.returncode:
+        raise AssertionError("{0} failed:\n{1}".format(" ".join(command), process.stdout))
+    return process.stdout
+
+
+def lcov_combine(tracefiles, output, cwd):
+    """
+    Merges tracefiles with lcov itself, so both sides of a comparison are written by the same lcov
+    """
+    command = ["lcov", "-q", "--rc", "lcov_branch_coverage=0"]
+    for tracefile in tracefiles:
+        command += ["-a", tracefile]
+    call(command + ["-o", output], cwd)
+    return os.path.join(cwd, output)
+
+
+def normalized(tracefile):
+    """
+    :return: tracefile lines, FNDA lines of every record sorted because lcov writes them in Perl hash order
+    """
+    lines = []
+    function_hits = []
+    with open(tracefile) as content:
+        for line in content:
+            line = line.rstrip("\n")
+            if line.startswith("FNDA:"):
+                function_hits.append(line)
+                continue
+            lines.extend(sorted(function_hits))
+            function_hits = []
+            lines.append(line)
+    return lines
+
+
+def assert_same(expected_file, actual_file):
+    expected = normalized(expected_file)
+    actual = normalized(actual_file)
+    if expected != actual:
+        difference = [line for line in expected if line not in actual][:10] + \
+            ["+ " + line for line in actual if line not in expected][:10]
+        raise AssertionError("{0} differs from {1}:\n{2}".format(actual_file, expected_file, "\n".join(difference)))
+
+
+# =================================================================================================
+# Checks
+# =================================================================================================
+
+def check_capture(folder):
+    """
+    Parallel coverage_capture gives the same data as serial lcov -c of the whole build folder
+    """
+    require_tools("gcc", "gcov", "lcov", "geninfo")
+    for name, content in CAPTURE_SOURCES.items():
+        rb.write_file(os.path.join(folder, name), content)
+    objects = []
+    for source in sorted(CAPTURE_SOURCES):
+        if source.endswith(".c"):
+            objects.append(os.path.splitext(source)[0] + ".o")
+            call(["gcc", "--coverage", "-O0", "-c", source, "-o", objects[-1]], folder)
+    call(["gcc", "--coverage", "-o", "tst_capture"] + objects, folder)
+    call([os.path.join(folder, "tst_capture")], folder)
+
+    call(["lcov", "-q", "--rc", "lcov_branch_coverage=0", "-c", "-d", ".", "-o", "serial.info"], folder)
+    expected = lcov_combine(["serial.info"], "expected.info", folder)
+
+    recipe = rb.make_recipe(conanfile.DynamicLibConanFile, folder)
+    recipe.coverage_capture_jobs = 4
+    with rb.working_folder(folder):
+        captured = recipe.coverage_capture("parallel")
+    actual = lcov_combine(captured, "actual.info", folder)
+    assert_same(expected, actual)
+
+
+def check_merge(folder):
+    """
+    LcovTracefile writes what lcov -a, lcov -e and lcov -r write for the same tracefiles and patterns
+    """
+    tracefiles = [os.path.join(FIXTURES_FOLDER, name) for name in ["test_initial.info", "test_coverage.info"]]
+    tracefile = conanfile.LcovTracefile(["*benchpkg/*"], ["*moc_*"])
+    for captured in tracefiles:
+        tracefile.read(captured)
+    tracefile.write(os.path.join(folder, "actual.info"))
+    assert_same(os.path.join(FIXTURES_FOLDER, "test.info"), os.path.join(folder, "actual.info"))
+
+    if not shutil.which("lcov"):
+        raise CheckSkipped("matches fixture, lcov not found")
+    lcov_combine(tracefiles, "test.info", folder)
+    call(["lcov", "-q", "--rc", "lcov_branch_coverage=0", "-e", "test.info", "*benchpkg/*", "-o", "test.info"], folder)
+    call(["lcov", "-q", "--rc", "lcov_branch_coverage=0", "-r", "test.info", "*moc_*", "-o", "test.info"], folder)
+    assert_same(os.path.join(folder, "test.info"), os.path.join(folder, "actual.info"))
+
+
+CHECKS = OrderedDict([
+    ("capture", check_capture),
+    ("merge", check_merge),
+])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--only", action="append", choices=list(CHECKS), help="run only given checks")
+    args = parser.parse_args()
+
+    failed = []
+    for name in args.only or list(CHECKS):
+        folder = tempfile.mkdtemp(prefix="check_{0}_".format(name))
+        try:
+            CHECKS[name](folder)
+            print("{0:<28} OK".format(name))
+        except CheckSkipped as error:
+            print("{0:<28} SKIPPED ({1})".format(name, error))
+        except AssertionError as error:
+            print("{0:<28} FAILED\n{1}".format(name, error))
+            failed.append(name)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
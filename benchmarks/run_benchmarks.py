@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of conanfile.py hot paths with local stand-ins for Conan objects and build tools.
+
+Every benchmark builds synthetic input in a temporary folder, runs recipe code against fake ConanFile, settings,
+options and output objects and stub qmake/make/lcov/geninfo/genhtml/test executables from stubs/bin.
+Best time of all repeats is compared with the baseline, run fails if any benchmark got slower than tolerance allows.
+
+Usage:
+    python benchmarks/run_benchmarks.py --save-baseline          # record baseline on this machine
+    python benchmarks/run_benchmarks.py                          # compare with baseline
+    python benchmarks/run_benchmarks.py --scale full --only package
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from fnmatch import fnmatch
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+REPO_FOLDER = os.path.dirname(BENCHMARKS_FOLDER)
+STUBS_FOLDER = os.path.join(BENCHMARKS_FOLDER, "stubs")
+STUBS_BIN_FOLDER = os.path.join(STUBS_FOLDER, "bin")
+
+sys.path.insert(0, REPO_FOLDER)
+for module_name in ["conans", "six"]:
+    try:
+        __import__(module_name)
+    except ImportError:
+        if STUBS_FOLDER not in sys.path:
+            sys.path.insert(1, STUBS_FOLDER)
+
+import conanfile  # noqa: E402
+
+# Sizes of synthetic inputs per scale
+SCALES = {
+    "small": {"headers": 10000,
+              "dependencies": 150,
+              "recipes": 150,
+              "builder_keys": 200,
+              "builder_calls": 2000,
+              "coverage_files": 200,
+              "coverage_lines": 2000,
+              "test_executables": 16},
+    "full": {"headers": 200000,
+             "dependencies": 2000,
+             "recipes": 150,
+             "builder_keys": 2000,
+             "builder_calls": 20000,
+             "coverage_files": 2000,
+             "coverage_lines": 8000,
+             "test_executables": 64},
+}
+
+
+# =================================================================================================
+# Fake Conan objects
+# =================================================================================================
+
+class FakeOutput(object):
+    def __init__(self):
+        self.lines = []
+
+    def _write(self, message):
+        self.lines.append(message)
+
+    info = warn = success = error = highlight = writeln = write = _write
+
+
+class FakeFields(object):
+    def __init__(self, **values):
+        self.__dict__["_values"] = OrderedDict(values)
+
+    def __getattr__(self, name):
+        return self._values.get(name)
+
+    def __setattr__(self, name, value):
+        self._values[name] = value
+
+    def __delattr__(self, name):
+        del self._values[name]
+
+    @property
+    def fields(self):
+        return list(self._values.keys())
+
+
+class FakeReference(object):
+    def __init__(self, reference):
+        self.reference = reference
+
+    def __str__(self):
+        return self.reference
+
+
+class FakeRequirements(OrderedDict):
+    """
+    Requirements container of Conan: iterable by name, item is reference, call adds requirement
+    """
+
+    def __call__(self, reference):
+        self[reference.split("/")[0]] = FakeReference(reference)
+
+
+class FakeConanFile(object):
+    name = "benchpkg"
+    version = "1.0.0"
+    channel = "stable"
+    in_local_cache = True
+    generators = ["qmake"]
+
+    def __init__(self, folder):
+        self.source_folder = folder
+        self.build_folder = folder
+        self.package_folder = os.path.join(folder, "package")
+        self.install_folder = folder
+        self.output = FakeOutput()
+        self.settings = FakeFields(os="Linux", compiler="gcc", build_type="Debug", arch="x86_64")
+        self.options = FakeFields(shared=True, unit_testing=False, with_coverage=False, sample=False)
+        self.requires = FakeRequirements()
+        self.build_requires = FakeRequirements()
+
+    def run(self, command, output=True, cwd=None, ignore_errors=False, **kwargs):
+        process = subprocess.run(command, shell=True, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True)
+        if hasattr(output, "write"):
+            output.write(process.stdout)
+        if process.returncode and not ignore_errors:
+            raise conanfile.ConanException("Error %d while executing %s" % (process.returncode, command))
+        return process.returncode
+
+    def copy(self, pattern, dst="", src="", keep_path=True, links=False, symlinks=None, excludes=None,
+             ignore_case=True):
+        """
+        Same walk-and-match algorithm as conans.client.file_copier.FileCopier
+        """
+        copied = []
+        pattern = pattern.lower() if ignore_case else pattern
+        roots = [self.source_folder] if self.source_folder == self.build_folder else \
+            [self.source_folder, self.build_folder]
+        for root in roots:
+            src_folder = os.path.join(root, src)
+            for folder, dirs, files in os.walk(src_folder, followlinks=True):
+                dirs[:] = [name for name in dirs if os.path.join(folder, name) != self.package_folder]
+                for filename in files:
+                    path = os.path.join(folder, filename)
+                    relative = os.path.relpath(path, src_folder)
+                    if not fnmatch(relative.lower() if ignore_case else relative, pattern):
+                        continue
+                    target = os.path.join(self.package_folder, dst, relative if keep_path else filename)
+                    if not os.path.isdir(os.path.dirname(target)):
+                        os.makedirs(os.path.dirname(target))
+                    if symlinks and os.path.islink(path):
+                        if os.path.lexists(target):
+                            os.remove(target)
+                        os.symlink(os.readlink(path), target)
+                    else:
+                        shutil.copy2(path, target)
+                    copied.append(target)
+        return copied
+
+
+def make_recipe(recipe_class, folder):
+    bench_class = type("Bench" + recipe_class.__name__, (recipe_class, FakeConanFile), {})
+    return bench_class(folder)
+
+
+# =================================================================================================
+# Synthetic inputs
+# =================================================================================================
+
+def write_file(path, content=""):
+    folder = os.path.dirname(path)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    with open(path, "w") as written:
+        written.write(content)
+
+
+def make_source_tree(folder, headers):
+    for index in range(headers):
+        subfolder = os.path.join(folder, "src", "module{0}".format(index // 500), "part{0}".format(index // 50))
+        write_file(os.path.join(subfolder, "header{0}.{1}".format(index, "h" if index % 4 else "hpp")),
+                   "#pragma once\n// synthetic header {0}\n".format(index))
+        if index % 10 == 0:
+            write_file(os.path.join(subfolder, "source{0}.cpp".format(index)), "int f{0}() {{ return 0; }}\n"
+                       .format(index))
+    for index in range(max(1, headers // 1000)):
+        write_file(os.path.join(folder, "src", "translation", "benchpkg_{0}.ts".format(index)), "<TS/>\n")
+        write_file(os.path.join(folder, "runtime", "data", "file{0}.dat".format(index)), "x" * 1024)
+        write_file(os.path.join(folder, "qmake_pri", "module{0}.pri".format(index)), "INCLUDEPATH += .\n")
+    write_file(os.path.join(folder, "libbenchpkg.so.1.0.0"), "\0" * 4096)
+    os.symlink("libbenchpkg.so.1.0.0", os.path.join(folder, "libbenchpkg.so"))
+
+
+def make_coverage_data(folder, files, lines):
+    """
+    Synthetic .gcno/.gcda files holding tracefile text, stubs/bin/geninfo just concatenates them
+    """
+    for index in range(files):
+        source = "/bench/benchpkg/src/module{0}/source{1}.cpp".format(index // 100, index)
+        if index % 10 == 0:
+            source = "/bench/build/moc_source{0}.cpp".format(index)
+        for extension, executed in [(".gcno", False), (".gcda", True)]:
+            record = ["TN:", "SF:" + source]
+            record.extend("FN:{0},_Z1f{1}i".format(line, line) for line in range(1, lines, 50))
+            record.extend("FNDA:{0},_Z1f{1}i".format(int(executed) * (line % 3), line)
+                          for line in range(1, lines, 50))
+            record.extend("DA:{0},{1}".format(line, int(executed) * (line % 7)) for line in range(1, lines))
+            record.append("end_of_record\n")
+            write_file(os.path.join(folder, "obj{0}".format(index // 500), "source{0}{1}".format(index, extension)),
+                       "\n".join(record))
+
+
+@contextlib.contextmanager
+def stub_tools():
+    old_path = os.environ.get("PATH", "")
+    os.environ["PATH"] = os.pathsep.join([STUBS_BIN_FOLDER, old_path])
+    try:
+        yield
+    finally:
+        os.environ["PATH"] = old_path
+
+
+@contextlib.contextmanager
+def working_folder(folder):
+    old_folder = os.getcwd()
+    os.chdir(folder)
+    try:
+        yield
+    finally:
+        os.chdir(old_folder)
+
+
+# =================================================================================================
+# Benchmarks. Each one is a generator: setup, yield measured callable, teardown
+# =================================================================================================
+
+def bench_package(folder, scale):
+    make_source_tree(folder, scale["headers"])
+    recipe = make_recipe(conanfile.DynamicLibConanFile, folder)
+
+    def measured():
+        if os.path.isdir(recipe.package_folder):
+            shutil.rmtree(recipe.package_folder)
+        with working_folder(folder):
+            recipe.package()
+
+    yield measured
+
+
+def bench_requirements_substitution(folder, scale):
+    references = ["dep{0}/1.{0}.0@monsoft/stable".format(index) for index in range(scale["dependencies"])]
+    recipes = [make_recipe(conanfile.DynamicLibConanFile, folder) for _ in range(scale["recipes"])]
+    old_channel = os.environ.get("OVERRIDE_CONAN_CHANNEL")
+    os.environ["OVERRIDE_CONAN_CHANNEL"] = "dev"
+
+    def measured():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for recipe in recipes:
+                recipe.requires.clear()
+                for reference in references[:max(1, len(references) // 8)]:
+                    recipe.requires(reference)
+                recipe.requirements_substitution("requires")
+
+    try:
+        yield measured
+    finally:
+        if old_channel is None:
+            del os.environ["OVERRIDE_CONAN_CHANNEL"]
+        else:
+            os.environ["OVERRIDE_CONAN_CHANNEL"] = old_channel
+
+
+def bench_build_parameters_string(folder, scale):
+    class BenchBuilder(conanfile.QMakeParametersBuilder):
+        qmake_var_name = "QMAKE_CXXFLAGS"
+        append_keys = {"all": ["-Wflag{0}".format(index) for index in range(scale["builder_keys"])],
+                       "os=Linux": ["-Wlinux{0}".format(index) for index in range(scale["builder_keys"])],
+                       "coverage": ["-fprofile-arcs", "-ftest-coverage"]}
+        remove_keys = {"all": ["-Wremoved{0}".format(index) for index in range(scale["builder_keys"])]}
+
+    recipe = make_recipe(conanfile.DynamicLibConanFile, folder)
+
+    def measured():
+        for _ in range(scale["builder_calls"]):
+            builder = BenchBuilder(recipe)
+            builder.add_special_case_parameters("coverage")
+            builder.build_parameters_string()
+
+    yield measured
+
+
+def _bench_coverage(folder, scale, report):
+    make_coverage_data(folder, scale["coverage_files"], scale["coverage_lines"])
+    recipe = make_recipe(conanfile.DynamicLibConanFile, folder)
+    recipe.coverage_report = report
+
+    def measured():
+        with stub_tools(), working_folder(folder):
+            recipe.coverage()
+
+    yield measured
+
+
+def bench_coverage_summary(folder, scale):
+    return _bench_coverage(folder, scale, "summary")
+
+
+def bench_coverage_cobertura(folder, scale):
+    return _bench_coverage(folder, scale, "cobertura")
+
+
+def bench_run_unit_test(folder, scale):
+    executables = []
+    for index in range(scale["test_executables"]):
+        executable = "tst_stub{0}".format(index)
+        shutil.copy2(os.path.join(STUBS_BIN_FOLDER, "tst_stub"), os.path.join(folder, executable))
+        executables.append(executable)
+    write_file(os.path.join(folder, "benchpkg_TestUnit.pro"), "TEMPLATE = app\n")
+    recipe = make_recipe(conanfile.DynamicLibConanFile, folder)
+
+    def measured():
+        with stub_tools(), working_folder(folder):
+            conanfile.QMakeHelper(recipe).run_unit_test(recipe.name, executables, is_headless=False)
+
+    yield measured
+
+
+BENCHMARKS = OrderedDict([
+    ("package", bench_package),
+    ("requirements_substitution", bench_requirements_substitution),
+    ("build_parameters_string", bench_build_parameters_string),
+    ("coverage_summary", bench_coverage_summary),
+    ("coverage_cobertura", bench_coverage_cobertura),
+    ("run_unit_test", bench_run_unit_test),
+])
+
+
+# =================================================================================================
+# Runner
+# =================================================================================================
+
+def run_benchmark(name, scale, repeat):
+    folder = tempfile.mkdtemp(prefix="bench_{0}_".format(name))
+    try:
+        benchmark = BENCHMARKS[name](folder, scale)
+        measured = next(benchmark)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            measured()
+            timings.append(time.perf_counter() - start)
+        benchmark.close()
+        return timings
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """
+    :return: list of benchmark names slower than baseline
+    """
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        reference = baseline.get("benchmarks", {}).get(name)
+        if reference is None:
+            print("{0:<28} no baseline".format(name))
+            continue
+        ratio = result["best"] / reference["best"] if reference["best"] else float("inf")
+        slower = result["best"] > reference["best"] * (1 + tolerance) and \
+            result["best"] - reference["best"] > min_delta
+        print("{0:<28} {1:>9.3f}s  baseline {2:>9.3f}s  {3:>6.2f}x {4}".format(
+            name, result["best"], reference["best"], ratio, "REGRESSION" if slower else ""))
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, best one counts")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="run only given benchmarks")
+    parser.add_argument("--output", default=os.path.join(BENCHMARKS_FOLDER, "results.json"))
+    parser.add_argument("--baseline", default=os.path.join(BENCHMARKS_FOLDER, "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true", help="save results as new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns smaller than seconds")
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    results = {"scale": args.scale, "python": sys.version.split()[0], "benchmarks": OrderedDict()}
+    for name in args.only or list(BENCHMARKS):
+        timings = run_benchmark(name, scale, args.repeat)
+        results["benchmarks"][name] = {"best": min(timings), "timings": timings}
+        print("{0:<28} {1:>9.3f}s".format(name, min(timings)))
+
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print("Baseline saved to " + args.baseline)
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print("No baseline found at {0}, run with --save-baseline first".format(args.baseline))
+        return 0
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("scale") != args.scale:
+        print("Baseline scale is {0}, nothing to compare".format(baseline.get("scale")))
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    if regressions:
+        print("Slower than baseline: " + ", ".join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
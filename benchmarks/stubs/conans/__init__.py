@@ -0,0 +1,91 @@
+# Local stand-in for the parts of Conan 1.x API used by conanfile.py.
+# Used by benchmarks only when real Conan is not installed.
+import contextlib
+import multiprocessing
+import os
+import shutil
+
+
+class ConanFile(object):
+    pass
+
+
+class CMake(object):
+    def __init__(self, conanfile, *args, **kwargs):
+        self.definitions = {}
+
+    def configure(self, *args, **kwargs):
+        pass
+
+    def build(self, *args, **kwargs):
+        pass
+
+
+class RunEnvironment(object):
+    def __init__(self, conanfile):
+        self.vars = {}
+
+
+class _OsInfo(object):
+    is_linux = os.name == "posix"
+    is_windows = os.name == "nt"
+    is_macos = False
+
+
+class _Tools(object):
+    os_info = _OsInfo()
+
+    @staticmethod
+    def cpu_count(output=None):
+        return int(os.getenv("CONAN_CPU_COUNT", multiprocessing.cpu_count()))
+
+    @staticmethod
+    def get_env(name, default=None):
+        value = os.getenv(name)
+        if value is None:
+            return default
+        if isinstance(default, bool):
+            return value.lower() in ["1", "true", "yes", "on"]
+        if isinstance(default, int):
+            return int(value)
+        return value
+
+    @staticmethod
+    def which(name):
+        return shutil.which(name)
+
+    @staticmethod
+    def mkdir(path):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def load(path):
+        with open(path) as loaded:
+            return loaded.read()
+
+    @staticmethod
+    def save(path, content):
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(path, "w") as saved:
+            saved.write(content)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def environment_append(env_vars):
+        old_env = dict(os.environ)
+        os.environ.update({name: str(value) for name, value in env_vars.items()})
+        try:
+            yield
+        finally:
+            os.environ.clear()
+            os.environ.update(old_env)
+
+    @staticmethod
+    def cross_building(settings):
+        return False
+
+
+tools = _Tools()
@@ -0,0 +1,5 @@
+from collections import OrderedDict
+
+
+class Requirements(OrderedDict):
+    pass
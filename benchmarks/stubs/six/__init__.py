@@ -0,0 +1,2 @@
+# Local stand-in for six, used by benchmarks only when six is not installed
+from io import StringIO
@@ -1,9 +1,23 @@
 from conans import ConanFile, CMake, tools, RunEnvironment
+import errno
+import hashlib
+import json
 import os
 import re
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import translate
+from xml.etree import ElementTree
 from conans.model.requires import Requirements
 from conans.errors import ConanException
 from six import StringIO
+from six.moves import queue
 from sys import platform
 
 
@@ -21,16 +35,265 @@ class NotCriticalException(Exception):
 # =================================================================================================
 # =================================================================================================
 
+# Build instrumentation
+
+
+class BuildProfiler(object):
+    """
+    Records every command run by build helpers: phase name, command, wall and CPU time, exit code and peak RSS.
+        Records are saved to build folder as JSON report and Chrome trace-event file (chrome://tracing, Perfetto)
+        after every command, so reports are there even if build fails.
+        CPU time and peak RSS are taken from resource usage of child processes, which is summed up (CPU) or maximal
+        (RSS) over all children finished so far. So they are written only if they belong to the phase: both are null
+        if phases of other threads ran at the same time, peak RSS is null if the high-water mark did not rise during
+        the phase.
+    """
+
+    report_filename = "build_profile.json"
+    trace_filename = "build_trace.json"
+
+    def __init__(self, conanfile):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        """
+        self.conanfile = conanfile
+        self.records = []
+        self._start = time.time()
+        self._lock = threading.Lock()
+        self._thread_ids = {}
+        self._active = []  # (thread id, record) of phases running now
+
+    @classmethod
+    def of(cls, conanfile):
+        """
+        :return: profiler of conanfile, one per recipe instance, so all helpers write to the same report
+        """
+        profiler = getattr(conanfile, "_build_profiler", None)
+        if profiler is None:
+            profiler = cls(conanfile)
+            conanfile._build_profiler = profiler
+        return profiler
+
+    @staticmethod
+    def _children_usage():
+        try:
+            import resource
+        except ImportError:  # Windows
+            return None, None
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        max_rss_kb = usage.ru_maxrss // 1024 if platform == "darwin" else usage.ru_maxrss
+        return usage.ru_utime + usage.ru_stime, max_rss_kb
+
+    @contextmanager
+    def phase(self, name, command=None):
+        """
+        Records time of with block as phase
+        :param name: phase name
+        :param command: command line or description of phase
+        :return: dict to put "exit_code" in
+        """
+        cpu_before, max_rss_kb_before = self._children_usage()
+        process_cpu_before = time.process_time()
+        start = time.time()
+        record = {"phase": name, "command": command, "exit_code": 0}
+        thread = threading.current_thread().ident
+        with self._lock:
+            # Nested phases of one thread do not disturb each other, phases of other threads do
+            if any(active_thread != thread for active_thread, _ in self._active):
+                record["_overlapped"] = True
+                for _, active in self._active:
+                    active["_overlapped"] = True
+            self._active.append((thread, record))
+        try:
+            yield record
+        except ConanException as err:
+            match = re.match(r"Error (-?\d+) while executing", str(err))
+            record["exit_code"] = int(match.group(1)) if match else None
+            raise
+        except Exception:
+            record["exit_code"] = None
+            raise
+        finally:
+            cpu_after, max_rss_kb = self._children_usage()
+            with self._lock:
+                self._active = [active for active in self._active if active[1] is not record]
+                overlapped = record.pop("_overlapped", False)
+            record["start"] = start - self._start
+            record["wall_time"] = time.time() - start
+            record["cpu_time"] = None if overlapped else time.process_time() - process_cpu_before + \
+                (cpu_after - cpu_before if cpu_after is not None else 0)
+            record["peak_rss_kb"] = max_rss_kb if not overlapped and max_rss_kb is not None and \
+                max_rss_kb > max_rss_kb_before else None
+            self._add(record)
+
+    def run(self, phase, command, **kwargs):
+        """
+        conanfile.run with recording
+        :param phase: phase name
+        :param command: command line
+        :param kwargs: conanfile.run arguments
+        :return: conanfile.run result
+        """
+        with self.phase(phase, command) as record:
+            retcode = self.conanfile.run(command, **kwargs)
+            if isinstance(retcode, int):
+                record["exit_code"] = retcode
+            return retcode
+
+    def _add(self, record):
+        with self._lock:
+            record["thread"] = self._thread_ids.setdefault(threading.current_thread().ident, len(self._thread_ids))
+            self.records.append(record)
+            try:
+                self.save(self.conanfile.build_folder)
+            except (IOError, OSError) as err:
+                self.conanfile.output.warn("Build profile not saved: " + str(err))
+
+    def save(self, folder):
+        """
+        Writes JSON report and Chrome trace to folder
+        :param folder:
+        :return:
+        """
+        if not folder:
+            return
+        report = {"package": str(self.conanfile.name),
+                  "version": str(self.conanfile.version),
+                  "wall_time": time.time() - self._start,
+                  "phases": self.records}
+        with open(os.path.join(folder, self.report_filename), "w") as report_file:
+            json.dump(report, report_file, indent=2)
+
+        events = [{"name": record["phase"],
+                   "cat": "build",
+                   "ph": "X",
+                   "ts": int(record["start"] * 1e6),
+                   "dur": int(record["wall_time"] * 1e6),
+                   "pid": os.getpid(),
+                   "tid": record["thread"],
+                   "args": {"command": record["command"],
+                            "exit_code": record["exit_code"],
+                            "cpu_time": record["cpu_time"],
+                            "peak_rss_kb": record["peak_rss_kb"]}} for record in self.records]
+        with open(os.path.join(folder, self.trace_filename), "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+
+# =================================================================================================
+# =================================================================================================
+
+# Requirements substitution
+
+
+class RequirementsSubstitution(object):
+    """
+    Channel override of requirements shared by all recipes loaded in the process. Rules and lockfile are read once per
+        configuration, substituted references are memoized.
+        Lockfile (CONAN_CHANNEL_LOCK) is JSON object of original -> substituted references, references found in it
+        are taken as is, others are substituted by channel map. CONAN_CHANNEL_LOCK_OUT collects substitutions made
+        by the process (and previous contents of file), so CI can resolve dev graph once and reuse it.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, channel, channel_map, lock_path=None, lock_out_path=None):
+        """
+        :param channel: override channel
+        :param channel_map: list of (replaced "user/channel", substitution) pairs
+        :param lock_path: lockfile to take substitutions from
+        :param lock_out_path: lockfile to write substitutions to
+        """
+        self.channel = channel
+        self.channel_map = channel_map
+        self.lock_out_path = lock_out_path
+        self.locked = self._load_lock(lock_path) if lock_path else {}
+        self.resolved = {}
+        self._lock = threading.Lock()
+        self._lock_out_dirty = False
+
+    @classmethod
+    def of(cls, conanfile):
+        """
+        :param conanfile: recipe with channel_substitutions
+        :return: substitution for current environment or None if channel is not overridden
+        """
+        env_channel = os.getenv("OVERRIDE_CONAN_CHANNEL") or os.getenv("CONAN_CHANNEL") # CONAN_CHANNEL reserved by Conan, and lead to side effects, deprecated now
+        if env_channel in conanfile.channel_substitutions:
+            channel = env_channel
+        elif conanfile.channel in conanfile.channel_substitutions:
+            channel = conanfile.channel
+        else:
+            return None
+
+        env_map = os.getenv("CONAN_CHANNEL_MAP")
+        key = (channel, env_map, os.getenv("CONAN_CHANNEL_LOCK"), os.getenv("CONAN_CHANNEL_LOCK_OUT"),
+               tuple(sorted(conanfile.channel_substitutions[channel].items())))
+        with cls._instances_lock:
+            if key not in cls._instances:
+                if env_map:  # "monsoft/stable=monsoft/dev,other/stable=other/dev"
+                    channel_map = [tuple(pair.split("=", 1)) for pair in env_map.split(",") if "=" in pair]
+                else:
+                    channel_map = sorted(conanfile.channel_substitutions[channel].items())
+                cls._instances[key] = cls(channel, channel_map, os.getenv("CONAN_CHANNEL_LOCK"),
+                                          os.getenv("CONAN_CHANNEL_LOCK_OUT"))
+            return cls._instances[key]
+
+    @staticmethod
+    def _load_lock(path):
+        if not os.path.isfile(path):
+            return {}
+        with open(path) as lock_file:
+            return json.load(lock_file)
+
+    def substitute(self, reference):
+        """
+        :param reference: requirement string
+        :return: substituted requirement string
+        """
+        with self._lock:
+            substituted = self.resolved.get(reference)
+            if substituted is None:
+                substituted = self.locked.get(reference)
+                if substituted is None:
+                    substituted = reference
+                    for replaced, substitution in self.channel_map:
+                        substituted = substituted.replace(replaced, substitution)
+                self.resolved[reference] = substituted
+                self._lock_out_dirty = self._lock_out_dirty or bool(self.lock_out_path)
+            return substituted
+
+    def save_lock(self):
+        """
+        Writes substitutions to CONAN_CHANNEL_LOCK_OUT if there are new ones
+        :return:
+        """
+        with self._lock:
+            if not self._lock_out_dirty:
+                return
+            lock = self._load_lock(self.lock_out_path)
+            lock.update(self.resolved)
+            tools.save(self.lock_out_path, json.dumps(lock, indent=1, sort_keys=True))
+            self._lock_out_dirty = False
+
+# =================================================================================================
+# =================================================================================================
+
 
 # Common ConanFile with common values and methods suitable for every MonitorSoft package
 class AbstractConanFile(object):
     license = "MonitorSoft Limited"
     additional_includedirs = []  # Variable to add some more dirs than standard (src->include) to includepath
+    package_link_mode = "auto"  # copy, hardlink, reflink or auto (reflink if filesystem supports it, else copy)
+    package_incremental = False  # skip files not changed since previous package() into the same package folder
+    # Override channel -> {replaced "user/channel": substitution}. CONAN_CHANNEL_MAP overrides map of current channel
+    channel_substitutions = {"dev": {"monsoft/stable": "monsoft/dev"}}
 
     def requirements_substitution(self, req_name):
         """
         Method for replacing dependencies channel from "stable" to "dev". It is used for complete replacement of channel
-            for all dependencies including all transition dependencies.
+            for all dependencies including all transition dependencies. Rules are taken from channel_substitutions,
+            see RequirementsSubstitution for environment variables and lockfile.
         :param req_name: name of Conan requirement variable. Conan has to variables Conanfile.requires and
             Conanfile.build_requires. Logic is the same for both methods. T
         :return:
@@ -45,23 +308,24 @@ class AbstractConanFile(object):
             raise Exception("Something bad happend during requirements manipulation")
 
         try:
-            env_channel = os.getenv("OVERRIDE_CONAN_CHANNEL") or os.getenv("CONAN_CHANNEL") # CONAN_CHANNEL reserved by Conan, and lead to side effects, deprecated now
-            if env_channel == "dev" or self.channel == "dev":
-                print("\033[93m{1} Stable to Dev substitution for package: {0}".format(self.name, print_text))
-                
+            substitution = RequirementsSubstitution.of(self)
+            if substitution is not None:
                 # Copying list from tuple
-                req_list = []
-                for dep in req_tuple:
-                    req_list.append(str(req_tuple[dep]))
-                req_tuple.clear()
-                # Iterate all deps
-                for dep in req_list:
-                    current_requirement = dep.replace("monsoft/stable", "monsoft/dev")
-                    print("\033[93m{1} set requirement: {0}".format(current_requirement, print_text))
-                    if req_name == "requires":
-                        self.requires(current_requirement)
-                    elif req_name == "build_requires":
-                        self.build_requires(current_requirement)
+                req_list = [str(req_tuple[dep]) for dep in req_tuple]
+                substituted_list = [substitution.substitute(dep) for dep in req_list]
+                # Requirements are re-added only if some of them changed, keeping their order
+                if substituted_list != req_list:
+                    req_tuple.clear()
+                    for current_requirement in substituted_list:
+                        if req_name == "requires":
+                            self.requires(current_requirement)
+                        elif req_name == "build_requires":
+                            self.build_requires(current_requirement)
+                substitution.save_lock()
+                print("\033[93m{0} channel {1} substitution for package {2}: {3} of {4} changed, {5} from lock".format(
+                    print_text, substitution.channel, self.name,
+                    sum(1 for dep, substituted in zip(req_list, substituted_list) if dep != substituted),
+                    len(req_list), sum(1 for dep in req_list if dep in substitution.locked)))
         except ConanException as err:
             print(f'\033[93m{print_text} Exception while channel override: {err}')
 
@@ -72,20 +336,22 @@ class AbstractConanFile(object):
         self.requirements_substitution("build_requires")
 
     def package(self):  # Redefine Conanfile method to implement custom logic.
-        self.copy("*.h", src="src", dst="include")
-        self.copy("*.hpp", src="src", dst="include")
-        self.copy("*.ts", src="src", dst="translation", keep_path=False)
-        self.copy("*", src="runtime", dst="runtime")
-        self.copy("*.pri", src="qmake_pri", dst="build_modules")
+        copier = PackageCopier(self, self.package_link_mode, self.package_incremental)
+        copier.copy("*.h", src="src", dst="include")
+        copier.copy("*.hpp", src="src", dst="include")
+        copier.copy("*.ts", src="src", dst="translation", keep_path=False)
+        copier.copy("*", src="runtime", dst="runtime")
+        copier.copy("*.pri", src="qmake_pri", dst="build_modules")
 
         if os.getcwd() == self.build_folder:
             if "shared" in self.options.fields: # check if shared applicable
                 if self.options.shared:
-                    self.copy("*.dll", src=self.build_folder, dst="lib", keep_path=False)
-                    self.copy("*.so*", src=self.build_folder, dst="lib", symlinks=True, keep_path=False)
+                    copier.copy("*.dll", src=self.build_folder, dst="lib", keep_path=False)
+                    copier.copy("*.so*", src=self.build_folder, dst="lib", symlinks=True, keep_path=False)
                 else:
-                    self.copy("*{0}.lib".format(self.name), src=self.build_folder, dst="lib", keep_path=False)
-                    self.copy("*.a", src=self.build_folder, dst="lib", keep_path=False)
+                    copier.copy("*{0}.lib".format(self.name), src=self.build_folder, dst="lib", keep_path=False)
+                    copier.copy("*.a", src=self.build_folder, dst="lib", keep_path=False)
+        copier.run()
 
     def package_info(self):
         # Combine full list of includedirs according to editable/not editable mode
@@ -123,11 +389,35 @@ class BuildableConanFile(AbstractConanFile):
                "qt_ver": ["5.5.1", "5.9.8", "5.13.2", "5.15.2", None],
                "unit_testing": [True, False],
                "with_coverage": [True, False],
+               "pch": [True, False],  # generate precompiled header from most included external headers
+               "unity_build": [True, False],  # compile sources in batches included into unity files
+               "fast_link": [True, False],  # lld or gold linker and lighter debug info for debug and coverage builds
+               "split_debug": [True, False],  # move debug info of packaged binaries to compressed .debug files
                "sample": [True, False]}  # option for isolate sample deps
     buildable_type = None  # [ shared, static, app ]
     unit_test_executables = None # list of test executables
     run_tests_headless = True # variable to define if fake gui windos needed for tests running. Default is True
+    unit_test_jobs = None # number of unit test executables running at once. Default is tools.cpu_count()
+    unit_test_isolated_displays = False # start own virtual display for every test worker instead of one shared
+    unit_test_incremental = False # keep object files of unit test build between runs instead of make clean
+    unit_test_coverage = True # build unit tests with coverage and capture it after run
+    unit_test_cache = True # skip tests passed before with the same fingerprint. Never used with unit_test_coverage
+    unit_test_shards = 1 # split QtTest functions of every test executable into this many concurrent runs
+    unity_build_batch_size = 8 # number of sources included into one unity file
+    unity_build_exclude = [] # source file names compiled separately in unity build
     cmake_definitions = {} # dict variable to customize CMake definitions before configure
+    coverage_include_patterns = None # source files kept in coverage report. Default is "*<lowercase name>/*"
+    coverage_exclude_patterns = ["*moc_*",
+                                 "*qrc_*",
+                                 "*ui_*",
+                                 "*test_package/*",
+                                 "*test_private/*",
+                                 "*test_unit/*"] # source files removed from coverage report
+    coverage_report = "summary" # summary, cobertura or html. Can be overridden with CONAN_COVERAGE_REPORT
+    coverage_capture_jobs = None # number of parallel coverage capture processes. Default is tools.cpu_count()
+    _coverage_capture_chunk_limit = 100000 # max length of data file names passed to one geninfo call
+    split_debug_folder = "debug" # package folder of .debug files. Can be overridden with CONAN_SPLIT_DEBUG_FOLDER
+    split_debug_info_file = "split_debug.json" # package file with debug folder used by package()
 
     # default options. DO NOT CHANGE "== None" TO "is None". IT BREAKS LOGIC. "== None" and "is None" ARE NOT THE SAME.
     def config_options(self):  # Redefine Conanfile method to implement custom logic.
@@ -137,6 +427,15 @@ class BuildableConanFile(AbstractConanFile):
             self.options.unit_testing = False
         if self.options.with_coverage == None:
             self.options.with_coverage = False
+        # Recipes redefining options may not have options added later, so they are checked like in build()
+        if "pch" in self.options.fields and self.options.pch == None:
+            self.options.pch = False
+        if "unity_build" in self.options.fields and self.options.unity_build == None:
+            self.options.unity_build = False
+        if "fast_link" in self.options.fields and self.options.fast_link == None:
+            self.options.fast_link = False
+        if "split_debug" in self.options.fields and self.options.split_debug == None:
+            self.options.split_debug = False
         if self.options.sample == None:
             self.options.sample = False
 
@@ -149,6 +448,18 @@ class BuildableConanFile(AbstractConanFile):
         else:
             raise Exception("Buildable type not specified")
 
+    def package_id(self):  # Redefine Conanfile method to implement custom logic.
+        # Options which only change how package is built, not its content. Keeps package ids of existing packages
+        if "pch" in self.options.fields:
+            del self.info.options.pch
+        if "unity_build" in self.options.fields:
+            del self.info.options.unity_build
+        if "fast_link" in self.options.fields:
+            del self.info.options.fast_link
+        # Only packages actually built with split debug info get new id
+        if "split_debug" in self.options.fields and not self.options.split_debug:
+            del self.info.options.split_debug
+
     def imports(self):  # Redefine Conanfile imports method to implement custom logic.
         # Copying pri files from build_modules dir
         self.copy("*.pri", src="build_modules", dst="build_modules")
@@ -163,30 +474,28 @@ class BuildableConanFile(AbstractConanFile):
             if self.generators == ["cmake"]:
                 # UnitTesting
                 if self.options.unit_testing:
-                    raise NotCriticalException("Unit testing for CMake not available")
+                    self.check_unit_test_environment()
+                    self.output.warn("Unit Testing starts")
+                    CMakeHelper(self).run_unit_test(self.run_tests_headless, self.unit_test_jobs,
+                                                    self.unit_test_coverage)
+                    if self.unit_test_coverage:
+                        self.coverage()
                 # Build
                 else:
-                    cmake = CMake(self)
-                    for definition_key in self.cmake_definitions:
-                        cmake.definitions[definition_key] = self.cmake_definitions[definition_key]
-                    cmake.configure()
-                    cmake.build()
+                    CMakeHelper(self).build(with_coverage=self.options.with_coverage)
             # QMake
             elif self.generators == ["qmake"]:
                 # UnitTesting
                 if self.options.unit_testing:
-                    # Check Environment
-                    if not self.settings.build_type == "Debug":
-                        raise Exception("Unit test available only for Debug builds")
-                    elif tools.cross_building(self.settings):
-                        raise Exception("Unit test not available for cross building")
-                    elif not tools.os_info.is_linux and not tools.os_info.is_windows:
-                        raise Exception("Unit test can be run only on linux or windows")
-                    else:
-                        self.output.warn("Unit Testing starts")
-                        if self.unit_test_executables is None:
-                            self.unit_test_executables = ["tst_{0}".format(self.name)]
-                        QMakeHelper(self).run_unit_test(self.name, self.unit_test_executables, self.run_tests_headless)
+                    self.check_unit_test_environment()
+                    self.output.warn("Unit Testing starts")
+                    if self.unit_test_executables is None:
+                        self.unit_test_executables = ["tst_{0}".format(self.name)]
+                    QMakeHelper(self).run_unit_test(self.name, self.unit_test_executables, self.run_tests_headless,
+                                                    self.unit_test_jobs, self.unit_test_isolated_displays,
+                                                    self.unit_test_incremental, self.unit_test_coverage,
+                                                    self.unit_test_cache, self.unit_test_shards)
+                    if self.unit_test_coverage:
                         self.coverage()
                 # Build
                 else:
@@ -197,44 +506,282 @@ class BuildableConanFile(AbstractConanFile):
         except NotCriticalException as err:
             self.output.warn("Build terminated. Not critical Excepiton: " + str(err))
     
+    def check_unit_test_environment(self):
+        """
+        Raises if unit tests can not be run with current settings
+        :return:
+        """
+        if not self.settings.build_type == "Debug":
+            raise Exception("Unit test available only for Debug builds")
+        elif tools.cross_building(self.settings):
+            raise Exception("Unit test not available for cross building")
+        elif not tools.os_info.is_linux and not tools.os_info.is_windows:
+            raise Exception("Unit test can be run only on linux or windows")
+
+    def package(self):
+        super(BuildableConanFile, self).package()  # Call parent package method
+        if "split_debug" in self.options.fields and self.options.split_debug:
+            self.split_debug_info()
+
     def package_info(self):
         super(BuildableConanFile, self).package_info()  # Call parent package_info method
         self.cpp_info.libs = [self.name]
         if "shared" in self.options.fields and not self.options.shared:
             self.cpp_info.defines = ["{0}_STATICLIB".format(self.name.upper())]
+        split_debug_info = os.path.join(self.package_folder, self.split_debug_info_file)
+        if "split_debug" in self.options.fields and self.options.split_debug and os.path.isfile(split_debug_info):
+            # Folder used by package(), consumer environment may point elsewhere. gdb: set debug-file-directory
+            debug_folder = json.loads(tools.load(split_debug_info))["debug_folder"]
+            self.user_info.debug_dir = os.path.join(self.package_folder, debug_folder)
+
+    def _split_debug_folder(self):
+        """
+        :return: absolute folder of .debug files. Relative CONAN_SPLIT_DEBUG_FOLDER is relative to package folder,
+            absolute one may point to symbol store shared by all packages outside of package
+        """
+        return os.path.join(self.package_folder, tools.get_env("CONAN_SPLIT_DEBUG_FOLDER", self.split_debug_folder))
+
+    def _split_debug_namespace(self, debug_folder):
+        """
+        :return: relative folder for debug files which are not found by build-id. Empty in package folder, unique for
+            package in symbol store shared by all packages, so libraries of different packages do not overwrite
+            each other
+        """
+        if not os.path.relpath(debug_folder, self.package_folder).startswith(os.pardir):
+            return ""
+        return os.path.join(self.name, str(self.version), self.info.package_id())
+
+    def split_debug_info(self):
+        """
+        Strips debug info from packaged ELF binaries and static libraries. Debug info of shared libraries and
+            executables is moved to compressed <debug folder>/.build-id/xx/yyyy.debug files, where gdb finds it by
+            build-id. Static libraries are kept unstripped in <debug folder>/lib. Stripped binaries are written to new
+            files, so files linked to build folder are not changed.
+        :return:
+        """
+        if self.settings.os != "Linux" or not tools.which("objcopy") or not tools.which("readelf"):
+            self.output.warn("Debug info is not split: Linux, objcopy and readelf are required")
+            return
+
+        debug_folder = self._split_debug_folder()
+        namespace = self._split_debug_namespace(debug_folder)
+        counters = {"files": 0, "size_before": 0, "size_after": 0}
+        with BuildProfiler.of(self).phase("split debug", debug_folder):
+            for root, dirs, files in os.walk(self.package_folder):
+                dirs[:] = [name for name in dirs if os.path.join(root, name) != debug_folder]
+                for filename in files:
+                    path = os.path.join(root, filename)
+                    if os.path.islink(path):
+                        continue
+                    with open(path, "rb") as binary:
+                        magic = binary.read(8)
+                    if magic.startswith(b"\x7fELF") or magic == b"!<arch>\n":
+                        size_before = os.path.getsize(path)
+                        if self._split_debug_file(path, debug_folder, namespace, is_archive=magic == b"!<arch>\n"):
+                            counters["files"] += 1
+                            counters["size_before"] += size_before
+                            counters["size_after"] += os.path.getsize(path)
+
+        # Relative to package folder if debug files are packaged, so it stays valid for downloaded packages
+        debug_folder_record = os.path.relpath(debug_folder, self.package_folder)
+        if debug_folder_record.startswith(os.pardir):
+            debug_folder_record = debug_folder
+        tools.save(os.path.join(self.package_folder, self.split_debug_info_file),
+                   json.dumps({"debug_folder": debug_folder_record}))
+
+        self.output.info("Debug info split from {0} files: {1:.1f} MiB -> {2:.1f} MiB, debug files in {3}".format(
+            counters["files"], counters["size_before"] / 1048576.0, counters["size_after"] / 1048576.0, debug_folder))
+
+    def _split_debug_file(self, path, debug_folder, namespace, is_archive):
+        """
+        :param path: packaged ELF file or static library
+        :param debug_folder:
+        :param namespace: subfolder of debug_folder for static libraries and binaries without build-id
+        :param is_archive: static library, kept unstripped instead of extracting debug info
+        :return: True if file had debug info and was stripped
+        """
+        buf = StringIO()
+        self.run('readelf --section-headers --wide "{0}"'.format(path), output=buf)
+        if ".debug_info" not in buf.getvalue():  # also matches compressed .zdebug_info
+            return False
+
+        stripped = path + ".stripped"
+        try:
+            if is_archive:
+                debug_file = os.path.join(debug_folder, "lib", namespace, os.path.basename(path))
+                tools.mkdir(os.path.dirname(debug_file))
+                self.run('objcopy --strip-debug "{0}" "{1}"'.format(path, stripped))
+                shutil.copymode(path, stripped)
+                # Symbol store may be on another filesystem
+                shutil.move(path, debug_file)
+            else:
+                buf = StringIO()
+                self.run('readelf --notes "{0}"'.format(path), output=buf)
+                build_id = re.search(r"Build ID:\s*([0-9a-f]+)", buf.getvalue())
+                if build_id:
+                    debug_file = os.path.join(debug_folder, ".build-id", build_id.group(1)[:2],
+                                              build_id.group(1)[2:] + ".debug")
+                else:
+                    debug_file = os.path.join(debug_folder, namespace,
+                                              os.path.relpath(path, self.package_folder) + ".debug")
+                tools.mkdir(os.path.dirname(debug_file))
+                self.run('objcopy --only-keep-debug --compress-debug-sections=zlib "{0}" "{1}"'.format(path,
+                                                                                                      debug_file))
+                self.run('objcopy --strip-debug --add-gnu-debuglink="{0}" "{1}" "{2}"'.format(debug_file, path,
+                                                                                             stripped))
+                shutil.copymode(path, stripped)
+            os.replace(stripped, path)
+        finally:
+            if os.path.exists(stripped):
+                os.remove(stripped)
+        return True
 
     def coverage(self):
-        if not tools.which("lcov") or not tools.which("genhtml"):
+        """
+        Captures coverage data, filters it and writes report according to coverage_report (or CONAN_COVERAGE_REPORT)
+            "summary" - only prints totals, "cobertura" - also writes coverage.xml, "html" - also runs genhtml
+        :return:
+        """
+        report = tools.get_env("CONAN_COVERAGE_REPORT", self.coverage_report)
+        if report not in ["summary", "cobertura", "html"]:
+            raise Exception("Unknown coverage report type {0}".format(report))
+        if not tools.which("lcov") or not tools.which("geninfo") or (report == "html" and not tools.which("genhtml")):
             raise Exception("Coverage tools missed")
 
         self.output.warn("Coverage utilities found")
         self.output.info("Capturing initial data...")
-        self.run("lcov -c --initial --directory . --output-file test_initial.info")
+        captured = self.coverage_capture("test_initial", initial=True)
 
         self.output.info("Capturing coverage data...")
-        self.run("lcov -c --directory . --output-file test_coverage.info")
-
-        self.output.info("Mixing coverage data...")
-        self.run("lcov --add-tracefile test_initial.info --add-tracefile test_coverage.info --output-file test.info",
-                 output=None)
-
-        self.output.info("Filtering coverage data...")
-        self.run("lcov -e test.info \"*" + self.name.lower() + "/*\" --output-file test.info", output=None)
-        self.run("lcov -r test.info \"*moc_*\" --output-file test.info", output=None)
-        self.run("lcov -r test.info \"*qrc_*\" --output-file test.info", output=None)
-        self.run("lcov -r test.info \"*ui_*\" --output-file test.info", output=None)
-        self.run("lcov -r test.info \"*test_package/*\" --output-file test.info", output=None)
-        self.run("lcov -r test.info \"*test_private/*\" --output-file test.info", output=None)
-        self.run("lcov -r test.info \"*test_unit/*\" --output-file test.info", output=None)
-
-        self.output.info("Writing coverage report...")
-        tools.mkdir("coverage")
+        captured += self.coverage_capture("test_coverage")
+
+        self.output.info("Mixing and filtering coverage data...")
+        include_patterns = self.coverage_include_patterns
+        if include_patterns is None:
+            include_patterns = ["*" + self.name.lower() + "/*"]
+        tracefile = LcovTracefile(include_patterns, self.coverage_exclude_patterns)
+        with BuildProfiler.of(self).phase("coverage filter", "merge and filter {0} tracefiles".format(len(captured))):
+            for captured_tracefile in captured:
+                tracefile.read(captured_tracefile)
+                os.remove(captured_tracefile)
+            tracefile.write("test.info")
+
+        if report == "cobertura":
+            self.output.info("Writing Cobertura coverage report...")
+            with BuildProfiler.of(self).phase("coverage cobertura", "coverage.xml"):
+                tracefile.write_cobertura("coverage.xml")
+        elif report == "html":
+            self.output.info("Writing coverage report...")
+            tools.mkdir("coverage")
+            BuildProfiler.of(self).run("coverage html", "genhtml test.info --output-directory coverage")
+
+        totals = tracefile.totals()
+        self.output.info("Total coverage: %s" % LcovTracefile.rate(totals.lines_hit(), totals.lines_found()))
+        self.output.info("Functions coverage: %s" % LcovTracefile.rate(totals.functions_hit(),
+                                                                       totals.functions_found()))
+
+    def coverage_capture(self, output_prefix, initial=False):
+        """
+        Captures coverage data of build folder. Gcov data files are split into chunks, each of files of one folder,
+            and geninfo (lcov -c backend) processes chunks in parallel, coverage_capture_jobs at once.
+            geninfo runs gcov in the folder of .gcda file, then collects and deletes all *.gcov files there, so every
+            chunk of run data is captured in its own folder, see _coverage_capture_folder. Initial capture only parses
+            .gcno files and runs in place.
+        :param output_prefix: partial tracefiles are written to <output_prefix>.<chunk>.info
+        :param initial: capture zero baseline from .gcno files instead of .gcda run data
+        :return: list of captured tracefiles
+        """
+        extension = ".gcno" if initial else ".gcda"
+        folders = {}
+        for root, _, files in os.walk("."):
+            data_files = sorted(filename for filename in files if filename.endswith(extension))
+            if data_files:
+                folders[os.path.abspath(root)] = data_files
+        if not folders:
+            raise Exception("No {0} files found in build folder".format(extension))
+
+        total = sum(len(data_files) for data_files in folders.values())
+        jobs = self.coverage_capture_jobs or tools.cpu_count()
+        jobs = max(1, min(int(jobs), total))
+        chunk_files = -(-total // jobs)
+
+        # Every command goes to shell as a single argument, which is limited to 128 KiB on Linux. Private folder name
+        # is a bit longer than original one
+        chunks = []  # (folder, data file names)
+        for folder in sorted(folders):
+            chunk = []
+            chunk_size = 0
+            for filename in folders[folder]:
+                size = len(folder) + len(filename) + 32
+                if chunk and (len(chunk) == chunk_files or chunk_size + size > self._coverage_capture_chunk_limit):
+                    chunks.append((folder, chunk))
+                    chunk = []
+                    chunk_size = 0
+                chunk.append(filename)
+                chunk_size += size
+            chunks.append((folder, chunk))
+        folder_locks = dict((folder, threading.Lock()) for folder in folders)
+
+        def capture(index_and_chunk):
+            index, (folder, chunk) = index_and_chunk
+            tracefile = os.path.abspath("{0}.{1}.info".format(output_prefix, index))
+            capture_folder = None
+            if not initial:
+                try:
+                    capture_folder = self._coverage_capture_folder(folder, chunk)
+                except (IOError, OSError) as err:
+                    self.output.warn("Capturing {0} in place: {1}".format(folder, err))
+            command = " ".join(["geninfo", "--initial" if initial else "", "--output-filename", tracefile] +
+                               ['"{0}"'.format(os.path.join(capture_folder or folder, data_file))
+                                for data_file in chunk])
+            buf = StringIO()
+            try:
+                # Chunks of run data captured in place never share a folder at the same time
+                with folder_locks[folder] if capture_folder is None and not initial else threading.Lock():
+                    retcode = BuildProfiler.of(self).run("coverage capture", command, output=buf, ignore_errors=True)
+                if retcode != 0:
+                    self.output.write(buf.getvalue())
+                    raise Exception("Coverage capture failed for {0}".format(tracefile))
+                if capture_folder is not None:
+                    with open(tracefile, "r", errors="surrogateescape") as captured:
+                        content = captured.read()
+                    with open(tracefile, "w", errors="surrogateescape") as captured:
+                        captured.write(content.replace("SF:" + capture_folder + os.sep, "SF:" + folder + os.sep))
+            finally:
+                if capture_folder is not None:
+                    shutil.rmtree(capture_folder, ignore_errors=True)
+            return tracefile
+
+        self.output.info("Capturing {0} {1} files of {2} folders in {3} chunks, {4} at once".format(
+            total, extension, len(folders), len(chunks), jobs))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(capture, enumerate(chunks)))
 
-        buf = StringIO()
-        self.run("genhtml test.info --output-directory coverage", output=buf)
-        pattern = re.compile(r"^\s*lines\.*:\s*(\d+\.\d+%)", re.MULTILINE)
-        match = pattern.search(buf.getvalue())
-        self.output.info("Total coverage: %s" % match.group(1))
+    @staticmethod
+    def _coverage_capture_folder(folder, data_files):
+        """
+        Makes private capture folder for .gcda files of one chunk. It is created next to their folder, so relative
+            source paths with ".." resolve the same, and holds links to data files, their .gcno files and all other
+            entries of folder, so sources inside of it resolve too. gcov writes .gcov files there, so chunks of one
+            folder do not collide. Captured paths inside of private folder are mapped back to folder.
+        :param folder: absolute folder of data files
+        :param data_files: .gcda file names
+        :return: private folder
+        """
+        capture_folder = tempfile.mkdtemp(prefix="." + os.path.basename(folder) + ".capture",
+                                          dir=os.path.dirname(folder))
+        try:
+            for filename in os.listdir(folder):
+                if not filename.endswith((".gcda", ".gcno", ".gcov")):
+                    os.symlink(os.path.join(folder, filename), os.path.join(capture_folder, filename))
+            for data_file in data_files:
+                for filename in [data_file, data_file[:-len(".gcda")] + ".gcno"]:
+                    if os.path.exists(os.path.join(folder, filename)):
+                        os.symlink(os.path.join(folder, filename), os.path.join(capture_folder, filename))
+        except (IOError, OSError):
+            shutil.rmtree(capture_folder, ignore_errors=True)
+            raise
+        return capture_folder
 
 
 # =================================================================================================
@@ -253,10 +800,16 @@ class StaticLibConanFile(BuildableConanFile):
 # ConanFile for packages which are builded to DynamicLibrary
 class DynamicLibConanFile(BuildableConanFile):
     buildable_type = "shared"
+    deploy_mode = "copy"  # copy, symlink or hardlink. Can be overridden with CONAN_DEPLOY_MODE. Windows always copies
 
     def deploy(self):
         if "shared" in self.options.fields:  # check if shared applicable
             if self.options.shared:
+                deploy_mode = tools.get_env("CONAN_DEPLOY_MODE", self.deploy_mode)
+                if deploy_mode != "copy" and self.settings.os != "Windows":
+                    self.deploy_linked(deploy_mode)
+                    return
+
                 if self.settings.os == "Linux":
                     self.copy("*.so*", src="lib", dst="bin", symlinks=True, keep_path=False)
                     self.copy_deps("*.so*", src="lib", dst="bin", keep_path=False)
@@ -268,6 +821,77 @@ class DynamicLibConanFile(BuildableConanFile):
                 self.copy("*", src="runtime", dst="bin")
                 self.copy_deps("*", src="runtime", dst="bin")
 
+    def deploy_linked(self, mode):
+        """
+        Deploys shared libraries and runtime of package and all dependencies to bin as links instead of copies.
+            Files with the same content from different packages are linked to one source. Entries already pointing to
+            the right file are not touched. Like with copy, dependencies files win over package files with the same name.
+        :param mode: symlink or hardlink
+        :return:
+        """
+        if mode not in ["symlink", "hardlink"]:
+            raise Exception("Unknown deploy mode {0}".format(mode))
+
+        roots = [(self.package_folder, True)] + \
+                [(self.deps_cpp_info[dep].rootpath, False) for dep in self.deps_cpp_info.deps]
+        entries = {}  # path relative to bin -> (source path, keep source symlink)
+        for root, keep_symlinks in roots:
+            # Whole lib tree goes flat to bin like copy with keep_path=False does
+            for folder, _, files in os.walk(os.path.join(root, "lib"), followlinks=True):
+                for filename in files:
+                    path = os.path.join(folder, filename)
+                    if ".so" in filename and os.path.isfile(path):
+                        entries[filename] = (path, keep_symlinks)
+            runtime_folder = os.path.join(root, "runtime")
+            for folder, _, files in os.walk(runtime_folder):
+                for filename in files:
+                    path = os.path.join(folder, filename)
+                    entries[os.path.relpath(path, runtime_folder)] = (path, False)
+
+        # Deduplicate identical files. Only files of equal size are hashed
+        by_size = {}
+        for path, _ in entries.values():
+            by_size.setdefault(os.path.getsize(path), set()).add(os.path.realpath(path))
+        canonical = {}
+        for paths in by_size.values():
+            if len(paths) > 1:
+                by_hash = {}
+                for path in sorted(paths):
+                    canonical[path] = by_hash.setdefault(FileTransfer.file_hash(path), path)
+
+        bin_folder = os.path.join(self.install_folder, "bin")
+        counters = {"symlink": 0, "hardlink": 0, "copy": 0, "unchanged": 0, "deduplicated": 0}
+        for relative in sorted(entries):
+            source, keep_symlinks = entries[relative]
+            target = os.path.join(bin_folder, relative)
+            if not os.path.isdir(os.path.dirname(target)):
+                os.makedirs(os.path.dirname(target))
+
+            if keep_symlinks and os.path.islink(source):
+                link = os.readlink(source)
+                link_mode = "symlink"
+            else:
+                real_source = os.path.realpath(source)
+                link = canonical.get(real_source, real_source)
+                if link != real_source:
+                    counters["deduplicated"] += 1
+                link_mode = mode
+
+            if link_mode == "symlink" and os.path.islink(target) and os.readlink(target) == link:
+                counters["unchanged"] += 1
+                continue
+            if link_mode == "hardlink" and os.path.isfile(target) and not os.path.islink(target) and \
+                    os.path.samefile(target, link):
+                counters["unchanged"] += 1
+                continue
+
+            # Hardlink falls back to copy across filesystems
+            counters[FileTransfer.place(link, target, link_mode)] += 1
+
+        self.output.info("Deployed {0} files to {1} as {2}: {3}".format(
+            len(entries), bin_folder, mode, ", ".join("{0} {1}".format(count, name)
+                                                     for name, count in counters.items() if count)))
+
 
 # =================================================================================================
 # =================================================================================================
@@ -280,6 +904,499 @@ class ApplicationConanFile(BuildableConanFile):
 # =================================================================================================
 # =================================================================================================
 
+# Coverage helpers
+
+
+class LcovRecord(object):
+    """
+    Coverage data of one source file for one test name
+    """
+
+    def __init__(self):
+        self.lines = {}  # line number -> execution count
+        self.functions = {}  # function name -> line number
+        self.function_hits = {}  # function name -> execution count
+
+    def add(self, other):
+        """
+        Sums up counts of other record into this one
+        :param other:
+        :type other: LcovRecord
+        :return:
+        """
+        for line_number, count in other.lines.items():
+            self.lines[line_number] = self.lines.get(line_number, 0) + count
+        self.functions.update(other.functions)
+        for name, count in other.function_hits.items():
+            self.function_hits[name] = self.function_hits.get(name, 0) + count
+
+    def lines_found(self):
+        return len(self.lines)
+
+    def lines_hit(self):
+        return sum(1 for count in self.lines.values() if count > 0)
+
+    def functions_found(self):
+        return len(self.function_hits)
+
+    def functions_hit(self):
+        return sum(1 for count in self.function_hits.values() if count > 0)
+
+
+class LcovTracefile(object):
+    """
+    Streaming lcov tracefile engine. Reads any number of tracefiles, merges them and applies include (lcov -e) and
+        exclude (lcov -r) patterns in one pass. Records of filtered out source files are skipped while reading.
+        Written tracefile has the same content lcov writes with default lcovrc: branch data and checksums are dropped,
+        summary lines are recalculated.
+    """
+
+    def __init__(self, include_patterns=None, exclude_patterns=None):
+        """
+        :param include_patterns: shell wildcard patterns, source file is kept if it matches any of them
+        :param exclude_patterns: shell wildcard patterns, source file is dropped if it matches any of them
+        """
+        self._include = [self._transform_pattern(pattern) for pattern in include_patterns or []]
+        self._exclude = [self._transform_pattern(pattern) for pattern in exclude_patterns or []]
+        self._selected = {}  # source file -> bool, pattern matching cache
+        self.records = {}  # source file -> {test name -> LcovRecord}
+
+    @staticmethod
+    def _transform_pattern(pattern):
+        # Same as transform_pattern in lcov: everything literal except * and ?
+        return re.compile(re.escape(pattern).replace("\\*", ".*").replace("\\?", "."), re.DOTALL)
+
+    def is_selected(self, source_file):
+        selected = self._selected.get(source_file)
+        if selected is None:
+            selected = (not self._include or any(regex.fullmatch(source_file) for regex in self._include)) and \
+                not any(regex.fullmatch(source_file) for regex in self._exclude)
+            self._selected[source_file] = selected
+        return selected
+
+    def read(self, filename):
+        """
+        Adds tracefile content, counts for the same source file and test name are summed up like lcov -a does.
+            Like read_info_file of lcov, source files without line data and test names without line data are dropped
+            from every tracefile before merging, function definitions of dropped test names stay with the source file.
+        :param filename: path to tracefile
+        :return:
+        """
+        records = {}  # source file -> {test name -> LcovRecord}, content of this tracefile only
+        test_name = ""
+        record = None
+        skip = False
+        with open(filename, "r", errors="surrogateescape") as tracefile:
+            for line in tracefile:
+                if skip:
+                    if line.startswith("end_of_record"):
+                        skip = False
+                    continue
+                line = line.rstrip("\n")
+                if line.startswith("DA:"):
+                    fields = line[3:].split(",")
+                    line_number = int(fields[0])
+                    record.lines[line_number] = record.lines.get(line_number, 0) + int(fields[1])
+                elif line.startswith("FNDA:"):
+                    count, name = line[5:].split(",", 1)
+                    record.function_hits[name] = record.function_hits.get(name, 0) + int(count)
+                elif line.startswith("FN:"):
+                    line_number, name = line[3:].split(",", 1)
+                    record.functions[name] = int(line_number)
+                elif line.startswith("SF:"):
+                    source_file = line[3:]
+                    if self.is_selected(source_file):
+                        record = records.setdefault(source_file, {}).setdefault(test_name, LcovRecord())
+                    else:
+                        skip = True
+                elif line.startswith("TN:"):
+                    test_name = line[3:].strip()
+                elif line.startswith("end_of_record"):
+                    record = None
+
+        for source_file, tests in records.items():
+            kept = dict((name, test) for name, test in tests.items() if test.lines)
+            if not kept:
+                continue
+            if len(kept) < len(tests):
+                functions = next(iter(kept.values())).functions
+                for name, test in tests.items():
+                    if name not in kept:
+                        functions.update(test.functions)
+            merged = self.records.setdefault(source_file, {})
+            for name, test in kept.items():
+                if name in merged:
+                    merged[name].add(test)
+                else:
+                    merged[name] = test
+
+    @staticmethod
+    def rate(hit, found):
+        """
+        Formats coverage rate the way genhtml does: 100% and 0% are shown only if really all or nothing is hit
+        :return: string like "85.3%"
+        """
+        if found == 0:
+            return "no data found"
+        rate = "{0:.1f}".format(hit * 100.0 / found)
+        if rate == "100.0" and hit < found:
+            rate = "99.9"
+        elif rate == "0.0" and hit > 0:
+            rate = "0.1"
+        return rate + "%"
+
+    def file_totals(self):
+        """
+        :return: dict source file -> LcovRecord with data of all test names summed up
+        """
+        totals = {}
+        for source_file, tests in self.records.items():
+            total = LcovRecord()
+            for record in tests.values():
+                total.add(record)
+            totals[source_file] = total
+        return totals
+
+    def totals(self):
+        """
+        :return: LcovRecord with counters of all source files, keyed by (source file, line or function) pairs
+        """
+        total = LcovRecord()
+        for source_file, record in self.file_totals().items():
+            total.lines.update(((source_file, line_number), count) for line_number, count in record.lines.items())
+            total.function_hits.update(((source_file, name), count) for name, count in record.function_hits.items())
+        return total
+
+    def write_cobertura(self, filename):
+        """
+        Writes Cobertura XML report with per-file (class) and per-directory (package) figures
+        :param filename: path to XML file
+        :return:
+        """
+        file_totals = self.file_totals()
+        source_root = os.path.commonpath([os.path.dirname(source_file) for source_file in file_totals]) \
+            if file_totals else ""
+
+        directories = {}
+        for source_file in sorted(file_totals):
+            directories.setdefault(os.path.dirname(os.path.relpath(source_file, source_root)), []).append(source_file)
+
+        def line_rate(hit, found):
+            return "{0:.4f}".format(float(hit) / found if found else 0.0)
+
+        lines_found = sum(record.lines_found() for record in file_totals.values())
+        lines_hit = sum(record.lines_hit() for record in file_totals.values())
+        coverage = ElementTree.Element("coverage", {"line-rate": line_rate(lines_hit, lines_found),
+                                                    "branch-rate": "0",
+                                                    "lines-covered": str(lines_hit),
+                                                    "lines-valid": str(lines_found),
+                                                    "branches-covered": "0",
+                                                    "branches-valid": "0",
+                                                    "complexity": "0",
+                                                    "version": "0",
+                                                    "timestamp": str(int(time.time() * 1000))})
+        ElementTree.SubElement(ElementTree.SubElement(coverage, "sources"), "source").text = source_root
+        packages = ElementTree.SubElement(coverage, "packages")
+
+        for directory in sorted(directories):
+            records = [file_totals[source_file] for source_file in directories[directory]]
+            package = ElementTree.SubElement(packages, "package", {
+                "name": directory.replace(os.sep, ".") or ".",
+                "line-rate": line_rate(sum(record.lines_hit() for record in records),
+                                       sum(record.lines_found() for record in records)),
+                "branch-rate": "0",
+                "complexity": "0",
+                "functions-covered": str(sum(record.functions_hit() for record in records)),
+                "functions-valid": str(sum(record.functions_found() for record in records))})
+            classes = ElementTree.SubElement(package, "classes")
+
+            for source_file in directories[directory]:
+                record = file_totals[source_file]
+                class_element = ElementTree.SubElement(classes, "class", {
+                    "name": os.path.basename(source_file),
+                    "filename": os.path.relpath(source_file, source_root),
+                    "line-rate": line_rate(record.lines_hit(), record.lines_found()),
+                    "branch-rate": "0",
+                    "complexity": "0"})
+                methods = ElementTree.SubElement(class_element, "methods")
+                for name in sorted(record.function_hits, key=lambda name: (record.functions.get(name, 0), name)):
+                    hits = record.function_hits[name]
+                    method = ElementTree.SubElement(methods, "method", {"name": name,
+                                                                        "signature": "",
+                                                                        "line-rate": "1" if hits else "0",
+                                                                        "branch-rate": "0",
+                                                                        "complexity": "0"})
+                    if name in record.functions:
+                        ElementTree.SubElement(ElementTree.SubElement(method, "lines"), "line", {
+                            "number": str(record.functions[name]), "hits": str(hits), "branch": "false"})
+                lines = ElementTree.SubElement(class_element, "lines")
+                for line_number in sorted(record.lines):
+                    ElementTree.SubElement(lines, "line", {"number": str(line_number),
+                                                           "hits": str(record.lines[line_number]),
+                                                           "branch": "false"})
+
+        ElementTree.ElementTree(coverage).write(filename, encoding="utf-8", xml_declaration=True)
+
+    def write(self, filename):
+        """
+        Writes merged and filtered data in lcov order: source files and test names sorted, functions sorted by line
+        :param filename: path to tracefile
+        :return:
+        """
+        if not self.records:
+            raise Exception("No coverage data left after filtering, nothing to write to " + filename)
+
+        with open(filename, "w", errors="surrogateescape") as tracefile:
+            for source_file in sorted(self.records):
+                tests = self.records[source_file]
+                # lcov keeps function definitions per source file, not per test
+                functions = {}
+                for record in tests.values():
+                    functions.update(record.functions)
+                sorted_functions = sorted(functions, key=lambda name: (functions[name], name))
+
+                for test_name in sorted(tests):
+                    record = tests[test_name]
+                    out = ["TN:" + test_name, "SF:" + source_file]
+                    out.extend("FN:{0},{1}".format(functions[name], name) for name in sorted_functions)
+                    out.extend("FNDA:{0},{1}".format(record.function_hits[name], name)
+                               for name in sorted(record.function_hits,
+                                                  key=lambda name: (functions.get(name, 0), name)))
+                    out.append("FNF:{0}".format(record.functions_found()))
+                    out.append("FNH:{0}".format(record.functions_hit()))
+                    out.extend("DA:{0},{1}".format(line_number, record.lines[line_number])
+                               for line_number in sorted(record.lines))
+                    out.append("LF:{0}".format(record.lines_found()))
+                    out.append("LH:{0}".format(record.lines_hit()))
+                    out.append("end_of_record\n")
+                    tracefile.write("\n".join(out))
+
+# =================================================================================================
+# =================================================================================================
+
+# Packaging helpers
+
+
+class FileTransfer(object):
+    """
+    Places files by copy, hardlink or reflink (copy-on-write clone, btrfs/xfs). Link modes fall back to copy if
+        source and destination are on different filesystems or filesystem does not support it.
+    """
+
+    modes = ["copy", "hardlink", "reflink", "symlink", "auto"]  # auto - reflink if possible, else copy
+    _ficlone = 0x40049409  # FICLONE ioctl request, Linux
+    _unsupported = set()  # (mode, source device, destination device) where linking already failed
+
+    @classmethod
+    def reflink(cls, src, dst):
+        import fcntl
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            try:
+                fcntl.ioctl(dst_file.fileno(), cls._ficlone, src_file.fileno())
+            except (IOError, OSError):
+                dst_file.close()
+                os.remove(dst)
+                raise
+        shutil.copystat(src, dst)
+
+    @classmethod
+    def place(cls, src, dst, mode="copy"):
+        """
+        :param src: source file path
+        :param dst: destination file path, replaced if exists
+        :param mode: one of FileTransfer.modes
+        :return: mode actually used
+        """
+        if mode not in cls.modes:
+            raise Exception("Unknown file transfer mode {0}".format(mode))
+        if os.path.lexists(dst):
+            os.remove(dst)
+        if mode == "symlink":
+            os.symlink(src, dst)  # src may be relative to dst folder like in os.symlink
+            return mode
+        if mode == "auto":
+            mode = "reflink" if platform in ["linux", "linux2"] else "copy"
+        if mode != "copy":
+            # Failed attempt costs extra syscalls per file, so devices pair is not tried again after first failure
+            devices = (mode, os.stat(src).st_dev, os.stat(os.path.dirname(os.path.abspath(dst))).st_dev)
+            if devices not in cls._unsupported:
+                try:
+                    if mode == "hardlink":
+                        os.link(src, dst)
+                    else:
+                        cls.reflink(src, dst)
+                    return mode
+                except (IOError, OSError):
+                    cls._unsupported.add(devices)
+        shutil.copy2(src, dst)
+        return "copy"
+
+    @staticmethod
+    def file_hash(path):
+        file_hash = hashlib.sha1()
+        with open(path, "rb") as hashed:
+            for block in iter(lambda: hashed.read(1 << 20), b""):
+                file_hash.update(block)
+        return file_hash.hexdigest()
+
+
+class PackageCopyRule(object):
+    """
+    One copy pattern, same meaning as arguments of ConanFile.copy
+    """
+
+    def __init__(self, pattern, src_folder, dst, keep_path=True, symlinks=False):
+        self.pattern = pattern
+        self.regex = re.compile(translate(pattern.lower()))  # patterns are case insensitive like in Conan
+        self.src_folder = src_folder
+        self.dst = dst
+        self.keep_path = keep_path
+        self.symlinks = symlinks
+
+
+class PackageCopier(object):
+    """
+    Replacement for series of ConanFile.copy calls in package(). All rules are collected first, then every source
+        root is walked once and each file is matched against all rules of that root. Files are placed with
+        FileTransfer, so they can be reflinked or hardlinked instead of copied. In incremental mode files with the same
+        size and mtime (or hash) as on previous run are not touched. Manifest of packaged files is saved to build folder.
+    """
+
+    manifest_filename = "package_copy_manifest.json"
+
+    def __init__(self, conanfile, link_mode="auto", incremental=False):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        :param link_mode: one of FileTransfer.modes. hardlink shares inode with build folder, so do not use it if build
+            folder files can be changed in place after packaging
+        :param incremental: skip files not changed since previous run into the same package folder
+        """
+        self.conanfile = conanfile
+        self.link_mode = link_mode
+        self.incremental = incremental
+        self.rules = []
+
+    def copy(self, pattern, src="", dst="", keep_path=True, symlinks=False):
+        """
+        Adds rule. Like ConanFile.copy in package(), relative src is looked up in both source and build folders
+        """
+        for root in [self.conanfile.source_folder, self.conanfile.build_folder]:
+            src_folder = os.path.normpath(os.path.join(root, src))
+            if not any(rule.src_folder == src_folder and rule.pattern == pattern and rule.dst == dst
+                       for rule in self.rules):
+                self.rules.append(PackageCopyRule(pattern, src_folder, dst, keep_path, symlinks))
+
+    def _walk_roots(self):
+        """
+        :return: dict walked folder -> rules, nested source folders are walked as part of parent one
+        """
+        roots = {}
+        for src_folder in sorted(set(rule.src_folder for rule in self.rules)):
+            parent = next((root for root in roots if src_folder.startswith(root + os.sep)), src_folder)
+            roots.setdefault(parent, [])
+        for rule in self.rules:
+            root = next(root for root in roots if rule.src_folder == root or rule.src_folder.startswith(root + os.sep))
+            roots[root].append(rule)
+        return roots
+
+    def _load_manifest(self, manifest_path):
+        if self.incremental and os.path.isfile(manifest_path):
+            try:
+                with open(manifest_path) as manifest_file:
+                    manifest = json.load(manifest_file)
+                if manifest.get("package_folder") == self.conanfile.package_folder:
+                    return manifest.get("files", {})
+            except ValueError:
+                pass
+        return {}
+
+    def _is_unchanged(self, src, dst, stat, previous):
+        if previous is None or previous.get("src") != src or not os.path.lexists(dst):
+            return False
+        if previous.get("size") != stat.st_size:
+            return False
+        if previous.get("mtime") == stat.st_mtime:
+            return True
+        return previous.get("sha1") is not None and previous["sha1"] == FileTransfer.file_hash(src)
+
+    def run(self):
+        """
+        Copies everything matched by rules to package folder
+        :return: list of packaged files relative to package folder
+        """
+        package_folder = os.path.normpath(self.conanfile.package_folder)
+        manifest_path = os.path.join(self.conanfile.build_folder, self.manifest_filename)
+        previous_files = self._load_manifest(manifest_path)
+        packaged = {}
+        counters = {"copy": 0, "hardlink": 0, "reflink": 0, "symlink": 0, "unchanged": 0}
+
+        # Like consecutive ConanFile.copy calls, each copying source folder then build folder: when several files go
+        # to the same target, the one of the latest rule wins, within one rule the latest walked one
+        rule_index = dict((id(rule), index) for index, rule in enumerate(self.rules))
+        matched = {}  # target relative to package folder -> (rule index, source file, rule)
+        for root, rules in self._walk_roots().items():
+            if not os.path.isdir(root):
+                continue
+            # Symlinked folders are followed like FileCopier does
+            for folder, dirs, files in os.walk(root, followlinks=True):
+                # Do not package package folder into itself if it is inside source root
+                dirs[:] = [name for name in dirs if os.path.join(folder, name) != package_folder]
+                for filename in files:
+                    path = os.path.join(folder, filename)
+                    for rule in rules:
+                        if not path.startswith(rule.src_folder + os.sep):
+                            continue
+                        relative = path[len(rule.src_folder) + 1:]
+                        if not rule.regex.match(relative.lower()):
+                            continue
+                        target_relative = os.path.normpath(os.path.join(rule.dst, relative if rule.keep_path
+                                                                        else filename))
+                        index = rule_index[id(rule)]
+                        if target_relative not in matched or matched[target_relative][0] <= index:
+                            matched[target_relative] = (index, path, rule)
+
+        for target_relative, (_, path, rule) in matched.items():
+            target = os.path.join(package_folder, target_relative)
+            packaged[target_relative] = self._place(path, target, rule, previous_files.get(target_relative),
+                                                    counters)
+
+        with open(manifest_path, "w") as manifest_file:
+            json.dump({"package_folder": self.conanfile.package_folder, "files": packaged}, manifest_file, indent=1)
+        self.conanfile.output.info("Packaged {0} files: {1}".format(
+            len(packaged), ", ".join("{0} {1}".format(count, name) for name, count in counters.items() if count)))
+        return sorted(packaged)
+
+    def _place(self, path, target, rule, previous, counters):
+        target_folder = os.path.dirname(target)
+        if not os.path.isdir(target_folder):
+            os.makedirs(target_folder)
+
+        if rule.symlinks and os.path.islink(path):
+            link = os.readlink(path)
+            if not (os.path.islink(target) and os.readlink(target) == link):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(link, target)
+            counters["symlink"] += 1
+            return {"src": path, "symlink": link}
+
+        stat = os.stat(path)
+        if self.incremental and self._is_unchanged(path, target, stat, previous):
+            counters["unchanged"] += 1
+            entry = dict(previous)
+            entry["mtime"] = stat.st_mtime
+            return entry
+
+        counters[FileTransfer.place(path, target, self.link_mode)] += 1
+        return {"src": path,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+                "sha1": FileTransfer.file_hash(path) if self.incremental else None}
+
+# =================================================================================================
+# =================================================================================================
+
 # QMake build helper
 
 
@@ -359,7 +1476,10 @@ class QMakeParametersBuilder(object):
 class QMakeConfigBuilder(QMakeParametersBuilder):
     qmake_var_name = "CONFIG"
     append_keys = {"all": ["skip_target_version_ext",
-                           "conan_exported"]}
+                           "conan_exported"],
+                   "ccache": ["ccache"],  # Qt ccache feature prepends ccache to QMAKE_CC and QMAKE_CXX
+                   "pch": ["precompile_header"],
+                   "unity_build": ["unity_build"]}  # feature is generated by QMakeHelper to build folder
     remove_keys = {"all": ["debug_and_release",
                            "debug_and_release_target"]}
 
@@ -374,7 +1494,9 @@ class QMakeCxxFlagsBuilder(QMakeParametersBuilder):
                    "coverage": ["-g",
                                 "-fprofile-arcs",
                                 "-ftest-coverage",
-                                "-O0"]}
+                                "-O0"],
+                   "compressed_debug": ["-gz"],
+                   "split_dwarf": ["-gsplit-dwarf"]}
     remove_keys = {}
 
 
@@ -391,16 +1513,817 @@ class QMakeCFlagsBuilder(QMakeParametersBuilder):
     append_keys = {"coverage": ["-g",
                                 "-fprofile-arcs",
                                 "-ftest-coverage",
-                                "-O0"]}
+                                "-O0"],
+                   "compressed_debug": ["-gz"],
+                   "split_dwarf": ["-gsplit-dwarf"]}
     remove_keys = {}
 
 
+#
+class QMakeLFlagsBuilder(QMakeParametersBuilder):
+    qmake_var_name = "QMAKE_LFLAGS"
+    append_keys = {"fast_link_lld": ["-fuse-ld=lld"],
+                   "fast_link_gold": ["-fuse-ld=gold"],
+                   "compressed_debug": ["-Wl,--compress-debug-sections=zlib"]}
+    remove_keys = {}
+
+
+#
+class QMakePrecompiledHeaderBuilder(QMakeParametersBuilder):
+    qmake_var_name = "PRECOMPILED_HEADER"
+    append_keys = {}
+    remove_keys = {}
+
+
+#
+class QMakeUnityBuildBatchSizeBuilder(QMakeParametersBuilder):
+    qmake_var_name = "UNITY_BUILD_BATCH_SIZE"
+    append_keys = {}
+    remove_keys = {}
+
+
+#
+class QMakeUnityBuildExcludeBuilder(QMakeParametersBuilder):
+    qmake_var_name = "UNITY_BUILD_EXCLUDE"
+    append_keys = {}
+    remove_keys = {}
+
+
+class PrecompiledHeaderGenerator(object):
+    """
+    Generates precompiled header from external (<...>) headers included by most translation units of package.
+        Includes of local headers are followed, includes inside #if blocks are ignored as they may be platform specific.
+        Scan results are cached in build folder per file size and mtime, so only changed files are read again.
+    """
+
+    index_filename = "pch_index.json"
+    source_extensions = (".cpp", ".cc", ".cxx")
+    header_extensions = (".h", ".hpp")
+    # Written by moc, rcc, uic and unity build into build folder, which is usually the source folder in Conan 1.
+    # Counting them makes usage of the next build differ and rewrites precompiled header, recompiling everything
+    generated_prefixes = ("moc_", "qrc_", "ui_")
+    generated_folders = ["pch", "unity_build"]  # relative to build folder
+    max_headers = 40  # headers in generated precompiled header
+    min_usage = 0.25  # part of translation units header must be included by
+    _directive = re.compile(r"^\s*#\s*(\w+)\s*(.*)$")
+    _include = re.compile(r"^([<\"])([^>\"]+)[>\"]")
+
+    def __init__(self, conanfile):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        """
+        self.conanfile = conanfile
+        self.index_path = os.path.join(conanfile.build_folder, self.index_filename)
+        self.header_path = os.path.join(conanfile.build_folder, "pch", "{0}_pch.h".format(conanfile.name))
+        self.index = {"files": {}}
+        if os.path.isfile(self.index_path):
+            try:
+                with open(self.index_path) as index_file:
+                    self.index = json.load(index_file)
+            except ValueError:
+                pass
+
+    @classmethod
+    def scan_file(cls, path):
+        """
+        :return: list of [kind, name] includes outside of conditional blocks, kind is "<" or "\""
+        """
+        includes = []
+        depth = 0
+        guard = None
+        with open(path, "r", errors="replace") as scanned:
+            for line in scanned:
+                match = cls._directive.match(line)
+                if not match:
+                    continue
+                directive, argument = match.groups()
+                if directive in ["if", "ifdef", "ifndef"]:
+                    # Include guard of header is not a condition
+                    if guard is None and directive == "ifndef" and depth == 0 and not includes and \
+                            path.endswith(cls.header_extensions):
+                        guard = argument.strip()
+                    depth += 1
+                elif directive == "endif":
+                    depth -= 1
+                elif directive == "include" and depth - (1 if guard else 0) == 0:
+                    include = cls._include.match(argument.strip())
+                    if include:
+                        includes.append(list(include.groups()))
+        return includes
+
+    def _update_index(self):
+        files = {}
+        excluded_folders = [self.conanfile.build_folder, os.path.dirname(self.header_path)] + \
+            [os.path.join(self.conanfile.build_folder, name) for name in self.generated_folders]
+        for root, dirs, filenames in os.walk(self.conanfile.source_folder):
+            dirs[:] = [name for name in dirs if not name.startswith(".") and name != "test_package" and
+                       os.path.join(root, name) not in excluded_folders]
+            for filename in filenames:
+                if not filename.endswith(self.source_extensions + self.header_extensions) or \
+                        filename.startswith(self.generated_prefixes):
+                    continue
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                cached = self.index["files"].get(path)
+                if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime:
+                    files[path] = cached
+                else:
+                    files[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "includes": self.scan_file(path)}
+        changed = files != self.index["files"]
+        self.index["files"] = files
+        return changed
+
+    def _usage(self):
+        """
+        :return: (dict external header -> number of translation units including it, number of translation units)
+        """
+        local_headers = {}
+        for path in self.index["files"]:
+            local_headers.setdefault(os.path.basename(path), path)
+
+        expanded = {}
+
+        def external_includes(path, visiting):
+            if path in expanded:
+                return expanded[path]
+            result = set()
+            visiting.add(path)
+            for kind, name in self.index["files"][path]["includes"]:
+                local = local_headers.get(os.path.basename(name))
+                if local is not None and (kind == "\"" or local.endswith(name)):
+                    if local not in visiting:
+                        result |= external_includes(local, visiting)
+                elif kind == "<":
+                    result.add(name)
+            visiting.discard(path)
+            expanded[path] = result
+            return result
+
+        usage = {}
+        units = [path for path in self.index["files"] if path.endswith(self.source_extensions)]
+        for unit in units:
+            for name in external_includes(unit, set()):
+                usage[name] = usage.get(name, 0) + 1
+        return usage, len(units)
+
+    def generate(self):
+        """
+        Updates index and writes precompiled header. Header file is rewritten only if its content changed
+        :return: path to precompiled header or None if there are no suitable headers
+        """
+        if self._update_index():
+            self.conanfile.output.info("Include index updated")
+        usage, units = self._usage()
+        threshold = max(2, int(units * self.min_usage))
+        headers = sorted([name for name, count in usage.items() if count >= threshold],
+                         key=lambda name: (-usage[name], name))[:self.max_headers]
+        self._save_index()
+        if not headers:
+            self.conanfile.output.warn("No headers suitable for precompiled header found")
+            return None
+
+        content = "\n".join(["// Generated by CommonConanFile from include index, do not edit",
+                             "#if defined __cplusplus"] +
+                            ["#include <{0}>".format(name) for name in headers] +
+                            ["#endif", ""])
+        if not os.path.isfile(self.header_path) or tools.load(self.header_path) != content:
+            tools.save(self.header_path, content)
+
+        avoided = sum(usage[name] for name in headers)
+        self.conanfile.output.info("Precompiled header {0}: {1} headers, expected {2} header parses avoided in {3} "
+                                   "translation units".format(self.header_path, len(headers), avoided, units))
+        return self.header_path
+
+    def _save_index(self):
+        with open(self.index_path, "w") as index_file:
+            json.dump(self.index, index_file)
+
+
+class XvfbDisplayPool(object):
+    """
+    Virtual X displays for headless unit testing. Servers are started once per build, Xvfb chooses free display
+        numbers itself (-displayfd), so concurrent builds on one agent do not collide. Use as context manager, servers
+        are stopped on exit even if tests crashed.
+    """
+
+    screen = "640x480x24"
+    start_timeout = 30  # seconds to wait for Xvfb to report its display
+
+    def __init__(self, conanfile, count=1, enabled=True):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        :param count: number of servers to start
+        :param enabled: if False pool gives no display and starts nothing
+        """
+        self.conanfile = conanfile
+        self.count = count
+        self.enabled = enabled
+        self._processes = []
+        self._displays = queue.Queue()
+
+    def __enter__(self):
+        if self.enabled:
+            try:
+                for _ in range(self.count):
+                    self._displays.put(self._start_server())
+            except Exception:
+                self.stop()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _start_server(self):
+        read_fd, write_fd = os.pipe()
+        try:
+            process = subprocess.Popen(["Xvfb", "-displayfd", str(write_fd), "-screen", "0", self.screen,
+                                        "-nolisten", "tcp"],
+                                       pass_fds=(write_fd,), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        finally:
+            os.close(write_fd)
+        self._processes.append(process)
+
+        display_number = b""
+        deadline = time.time() + self.start_timeout
+        try:
+            while not display_number.endswith(b"\n"):
+                ready, _, _ = select.select([read_fd], [], [], max(0, deadline - time.time()))
+                chunk = os.read(read_fd, 16) if ready else b""
+                if not chunk:
+                    raise Exception("Xvfb failed to start, exit code {0}".format(process.poll()))
+                display_number += chunk
+        finally:
+            os.close(read_fd)
+
+        display = ":" + display_number.decode().strip()
+        self.conanfile.output.info("Xvfb started on display {0} (pid {1})".format(display, process.pid))
+        return display
+
+    def stop(self):
+        for process in self._processes:
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+        self._processes = []
+
+    @contextmanager
+    def acquire(self):
+        """
+        Takes display for exclusive or shared use until the end of with block
+        :return: display string like ":99" or None if pool disabled
+        """
+        if not self.enabled:
+            yield None
+            return
+        display = self._displays.get()
+        try:
+            # Single display is shared by all workers, X server handles many clients
+            if self.count == 1:
+                self._displays.put(display)
+            yield display
+        finally:
+            if self.count != 1:
+                self._displays.put(display)
+
+
+class MakeJobScheduler(object):
+    """
+    Chooses make parallelism. Jobs are limited by cpu count, by available memory per compile job and, if token pool
+        folder is set, by a GNU make jobserver shared between all builds on the host. Make takes a token from the pool
+        FIFO for every job besides its first one and puts it back as soon as the job ends, so tokens flow to builds
+        which have work. Tools which are not jobserver clients (ninja) hold taken tokens for the whole run. Tokens of
+        a killed make are lost until all builds using the pool end. Load average limit is passed to make as -l.
+    """
+
+    jobserver_fd = 3  # descriptor make gets pool FIFO on, opened by shell running make command
+
+    def __init__(self, conanfile, memory_per_job=0, load_average=0, token_pool=None, token_pool_size=0):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        :param memory_per_job: MiB of available memory needed by one compile job, 0 - no memory limit
+        :param load_average: do not start new jobs while load average is above, 0 - no limit
+        :param token_pool: folder with jobserver FIFO shared by concurrent builds, None - no pool
+        :param token_pool_size: number of jobs of all builds using pool, 0 - tools.cpu_count()
+        """
+        self.conanfile = conanfile
+        self.memory_per_job = memory_per_job
+        self.load_average = load_average
+        self.token_pool = token_pool
+        self.token_pool_size = token_pool_size or tools.cpu_count()
+
+    @classmethod
+    def from_environment(cls, conanfile):
+        """
+        Scheduler configured with CONAN_MAKE_MEMORY_PER_JOB (MiB), CONAN_MAKE_LOAD_AVERAGE, CONAN_MAKE_TOKEN_POOL
+            (folder) and CONAN_MAKE_TOKEN_POOL_SIZE environment variables
+        """
+        return cls(conanfile,
+                   memory_per_job=int(tools.get_env("CONAN_MAKE_MEMORY_PER_JOB", "0")),
+                   load_average=float(tools.get_env("CONAN_MAKE_LOAD_AVERAGE", "0")),
+                   token_pool=tools.get_env("CONAN_MAKE_TOKEN_POOL", None),
+                   token_pool_size=int(tools.get_env("CONAN_MAKE_TOKEN_POOL_SIZE", "0")))
+
+    @staticmethod
+    def available_memory():
+        """
+        :return: available memory in MiB or None if unknown
+        """
+        try:
+            with open("/proc/meminfo") as meminfo:
+                for line in meminfo:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) // 1024
+        except (IOError, OSError, ValueError):
+            pass
+        return None
+
+    def jobs_limit(self):
+        jobs = tools.cpu_count()
+        if self.memory_per_job:
+            available_memory = self.available_memory()
+            if available_memory is not None:
+                jobs = min(jobs, available_memory // self.memory_per_job)
+                self.conanfile.output.info("Available memory {0} MiB allows {1} jobs".format(
+                    available_memory, max(1, jobs)))
+        return max(1, jobs)
+
+    def make_arguments(self, jobs):
+        """
+        :param jobs: number of jobs, None - make takes jobs from jobserver of token pool
+        :return: make arguments, for jobserver the shell redirection opening pool FIFO on jobserver_fd
+        """
+        if jobs is None:
+            arguments = ["{0}<>\"{1}\"".format(self.jobserver_fd, os.path.join(self.token_pool, "jobserver"))]
+        else:
+            arguments = ["-j{0}".format(jobs)]
+        if self.load_average:
+            arguments.append("-l{0}".format(self.load_average))
+        return " ".join(arguments)
+
+    @contextmanager
+    def _join_pool(self, jobs):
+        """
+        Opens jobserver FIFO of token pool, the first of concurrent builds fills it with tokens. Pipe keeps tokens only
+            while it is open somewhere, so FIFO stays open until make ends. Builds using pool hold shared lock of
+            jobserver.lock, other pool files are only checked and filled under exclusive lock of jobserver.mutex.
+        :param jobs: jobs limit of this build, tokens of a new pool are limited by it too
+        :return: descriptor of FIFO opened for reading and writing
+        """
+        import fcntl
+        tools.mkdir(self.token_pool)
+        fifo = os.path.join(self.token_pool, "jobserver")
+        holders = open(os.path.join(self.token_pool, "jobserver.lock"), "a")
+        try:
+            with open(os.path.join(self.token_pool, "jobserver.mutex"), "a") as mutex:
+                fcntl.flock(mutex, fcntl.LOCK_EX)
+                if not os.path.exists(fifo):
+                    os.mkfifo(fifo)
+                descriptor = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+                try:
+                    fcntl.flock(holders, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    # No other build has FIFO open, so tokens of previous ones are gone with their pipe.
+                    # First job of every make runs without token
+                    os.write(descriptor, b"+" * (min(jobs, self.token_pool_size) - 1))
+                except (IOError, OSError):
+                    pass
+                fcntl.flock(holders, fcntl.LOCK_SH)
+            try:
+                yield descriptor
+            finally:
+                # FIFO is closed before lock is released, build getting exclusive lock after that finds pipe empty
+                os.close(descriptor)
+        finally:
+            holders.close()
+
+    @staticmethod
+    def _take_tokens(descriptor, count):
+        tokens = b""
+        while len(tokens) < count:
+            try:
+                token = os.read(descriptor, count - len(tokens))
+            except (IOError, OSError) as error:
+                if error.errno != errno.EAGAIN:
+                    raise
+                break
+            if not token:
+                break
+            tokens += token
+        return tokens
+
+    @contextmanager
+    def reserve(self, jobserver=True):
+        """
+        Reserves jobs for one make run
+        :param jobserver: make is a jobserver client, it gets make_arguments(None) and takes tokens while it runs.
+            Otherwise free tokens are taken for the whole run
+        :return: number of jobs make may run, None if make takes jobs from jobserver of token pool
+        """
+        jobs = self.jobs_limit()
+        if not self.token_pool or platform not in ["linux", "linux2", "darwin"]:
+            yield jobs
+            return
+        with self._join_pool(jobs) as descriptor:
+            if jobserver:
+                self.conanfile.output.info("Make takes jobs from jobserver of {0} tokens in {1}".format(
+                    self.token_pool_size, self.token_pool))
+                makeflags = "-j --jobserver-fds={0},{0}".format(self.jobserver_fd)
+                with tools.environment_append({"MAKEFLAGS": " ".join(filter(None, [os.environ.get("MAKEFLAGS"),
+                                                                                   makeflags]))}):
+                    yield None
+                return
+            tokens = self._take_tokens(descriptor, jobs - 1)
+            self.conanfile.output.info("Got {0} of {1} make tokens".format(len(tokens) + 1, self.token_pool_size))
+            try:
+                yield len(tokens) + 1
+            finally:
+                if tokens:
+                    os.write(descriptor, tokens)
+
+
+class UnitTestResult(object):
+    """
+    Result of a single unit test executable run
+    """
+
+    # Characters not allowed in XML 1.0 documents, test output is full of terminal escape sequences
+    _xml_invalid_chars = re.compile(u"[^\u0009\u000A\u000D\u0020-\uD7FF\uE000-\uFFFD]")
+
+    def __init__(self, name, command, retcode, output, duration, cached=False):
+        """
+        :param name: test executable name
+        :param command: full command line used to run test
+        :param retcode: exit code of test executable
+        :param output: captured stdout and stderr
+        :param duration: wall time in seconds
+        :param cached: result taken from UnitTestCache, test was not run
+        """
+        self.name = name
+        self.command = command
+        self.retcode = retcode
+        self.output = output
+        self.duration = duration
+        self.cached = cached
+
+    @property
+    def passed(self):
+        return self.retcode == 0
+
+    def xml_output(self):
+        return self._xml_invalid_chars.sub("", self.output)
+
+    @staticmethod
+    def report(conanfile, results, report_filename="unit_test_results.xml"):
+        """
+        Prints combined summary, writes JUnit XML report to build folder and fails if any test failed
+        :param conanfile:
+        :param results: list of UnitTestResult
+        :param report_filename: JUnit XML report file name
+        :return:
+        """
+        failed = [result for result in results if not result.passed]
+
+        testsuite = ElementTree.Element("testsuite", name=str(conanfile.name), tests=str(len(results)),
+                                        failures=str(len(failed)), errors="0",
+                                        time="{0:.3f}".format(sum(result.duration for result in results)))
+        for result in results:
+            testcase = ElementTree.SubElement(testsuite, "testcase", classname=str(conanfile.name),
+                                              name=result.name, time="{0:.3f}".format(result.duration))
+            if not result.passed:
+                failure = ElementTree.SubElement(testcase, "failure",
+                                                 message="Exit code {0}".format(result.retcode))
+                failure.text = result.xml_output()
+            ElementTree.SubElement(testcase, "system-out").text = result.xml_output()
+
+        report_path = os.path.join(conanfile.build_folder, report_filename)
+        ElementTree.ElementTree(testsuite).write(report_path, encoding="utf-8", xml_declaration=True)
+
+        conanfile.output.info("Unit tests summary: {0} passed ({1} cached), {2} failed, total {3}".format(
+            len(results) - len(failed), len([result for result in results if result.cached]), len(failed),
+            len(results)))
+        for result in results:
+            conanfile.output.info("    {0} {1} ({2:.2f}s)".format("CACHED" if result.cached else
+                                                                "PASSED" if result.passed else "FAILED",
+                                                                result.name, result.duration))
+        conanfile.output.info("JUnit report: " + report_path)
+
+        if failed:
+            raise Exception("Unit tests failed: {0}".format(", ".join(result.name for result in failed)))
+
+
+class UnitTestCache(object):
+    """
+    Results of passed unit test executables keyed by fingerprint of executable, shared libraries it loads from
+        RunEnvironment folders and build folder, and environment affecting tests. Test with the same fingerprint as
+        in its last passed run is not run again.
+    """
+
+    cache_filename = "unit_test_cache.json"
+    environment_prefixes = ("QT_", "QML", "LANG", "LC_", "TZ")
+    _ldd_line = re.compile(r"=>\s*(\S+)\s+\(0x")
+
+    def __init__(self, conanfile, run_environment, is_headless):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        :param run_environment: RunEnvironment vars tests are run with
+        :param is_headless:
+        """
+        self.conanfile = conanfile
+        self.cache_path = os.path.join(tools.get_env("CONAN_UNIT_TEST_CACHE_DIR", conanfile.build_folder),
+                                       self.cache_filename)
+        self._lock = threading.Lock()
+        self._hashes = {}  # (path, size, mtime) -> sha1, libraries are shared by many tests
+        self.entries = {}
+        if os.path.isfile(self.cache_path):
+            try:
+                with open(self.cache_path) as cache_file:
+                    self.entries = json.load(cache_file)
+            except ValueError:
+                self.conanfile.output.warn("Unit test cache {0} is broken, ignored".format(self.cache_path))
+
+        self.library_folders = [os.path.realpath(conanfile.build_folder)]
+        for name in ["LD_LIBRARY_PATH", "DYLD_LIBRARY_PATH", "PATH"]:
+            folders = run_environment.get(name, [])
+            self.library_folders.extend(os.path.realpath(folder) for folder in
+                                        (folders if isinstance(folders, list) else [folders]))
+        environment = dict((name, value) for name, value in os.environ.items()
+                           if name.startswith(self.environment_prefixes))
+        environment["headless"] = str(is_headless)
+        self._environment = json.dumps([environment, run_environment], sort_keys=True)
+
+    def _file_hash(self, path):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime)
+        with self._lock:
+            if key in self._hashes:
+                return self._hashes[key]
+        file_hash = FileTransfer.file_hash(path)
+        with self._lock:
+            self._hashes[key] = file_hash
+        return file_hash
+
+    def _libraries(self, executable):
+        """
+        :return: sorted real paths of shared libraries loaded by executable from library folders
+        """
+        libraries = set()
+        buf = StringIO()
+        if tools.which("ldd") and self.conanfile.run('ldd "{0}"'.format(executable), output=buf,
+                                                     ignore_errors=True) == 0:
+            candidates = self._ldd_line.findall(buf.getvalue())
+        else:
+            # Dependencies are unknown, every library of run environment counts
+            candidates = []
+            for folder in self.library_folders:
+                if os.path.isdir(folder):
+                    candidates.extend(os.path.join(folder, filename) for filename in os.listdir(folder)
+                                      if filename.endswith(".dll") or ".so" in filename or filename.endswith(".dylib"))
+        for candidate in candidates:
+            path = os.path.realpath(candidate)
+            if os.path.isfile(path) and any(path.startswith(folder + os.sep) for folder in self.library_folders):
+                libraries.add(path)
+        return sorted(libraries)
+
+    def fingerprint(self, executable):
+        """
+        :param executable: path to test executable
+        :return: hex digest string
+        """
+        fingerprint = hashlib.sha1(self._environment.encode("utf-8"))
+        for path in [os.path.realpath(executable)] + self._libraries(executable):
+            fingerprint.update(path.encode("utf-8") + b"\0" + self._file_hash(path).encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    def _key(self, name):
+        return "{0}/{1}".format(self.conanfile.name, name)
+
+    def lookup(self, name, fingerprint):
+        """
+        :return: cached UnitTestResult or None if test has to be run
+        """
+        with self._lock:
+            entry = self.entries.get(self._key(name))
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        return UnitTestResult(name, entry["command"], 0, "Passed before with the same fingerprint {0}\n".format(
+            fingerprint), entry["duration"], cached=True)
+
+    def store(self, result, fingerprint):
+        """
+        Remembers passed result, failed one removes previous entry
+        """
+        with self._lock:
+            if result.passed:
+                self.entries[self._key(result.name)] = {"fingerprint": fingerprint, "command": result.command,
+                                                        "duration": result.duration}
+            else:
+                self.entries.pop(self._key(result.name), None)
+
+    def save(self):
+        tools.save(self.cache_path, json.dumps(self.entries, indent=1, sort_keys=True))
+
+
+class QtTestSharding(object):
+    """
+    Splits QtTest functions of test executable into shards balanced by durations of previous runs (longest first)
+        and merges QtTest XML reports of shards. Coverage of shards is merged by gcov runtime itself, which updates
+        .gcda files under file lock when process exits.
+    """
+
+    history_filename = "unit_test_durations.json"
+    reports_folder = "qtest_shards"
+    _function_line = re.compile(r"^(\w+)\(\)\s*$", re.MULTILINE)
+    # Run by every shard and not listed with -functions, so they are not planned and their durations are not recorded
+    _fixture_functions = ("initTestCase", "cleanupTestCase")
+
+    def __init__(self, conanfile):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        """
+        self.conanfile = conanfile
+        self.history_path = os.path.join(tools.get_env("CONAN_UNIT_TEST_CACHE_DIR", conanfile.build_folder),
+                                         self.history_filename)
+        self._lock = threading.Lock()
+        self.durations = {}  # "<package>/<executable>[::<function>]" -> seconds
+        if os.path.isfile(self.history_path):
+            try:
+                with open(self.history_path) as history_file:
+                    # Histories written before fixture functions were skipped have them too
+                    self.durations = dict((key, duration) for key, duration in json.load(history_file).items()
+                                          if key.rsplit("::", 1)[-1] not in self._fixture_functions)
+            except ValueError:
+                self.conanfile.output.warn("Unit test durations {0} are broken, ignored".format(self.history_path))
+
+    @classmethod
+    def parse_functions(cls, output):
+        """
+        :param output: output of test executable run with -functions
+        :return: list of test function names
+        """
+        return cls._function_line.findall(output)
+
+    def _key(self, test_executable, function=None):
+        key = "{0}/{1}".format(self.conanfile.name, test_executable)
+        return key if function is None else key + "::" + function
+
+    def expected_duration(self, test_executable, functions=None):
+        """
+        :param functions: functions of shard or None for whole executable
+        :return: seconds according to previous runs, unknown functions take average duration of known ones
+        """
+        with self._lock:
+            if functions is None:
+                return self.durations.get(self._key(test_executable), 0.0)
+            prefix = self._key(test_executable, "")
+            known = [duration for key, duration in self.durations.items() if key.startswith(prefix)]
+            default = sum(known) / len(known) if known else 1.0
+            return sum(self.durations.get(self._key(test_executable, function), default) for function in functions)
+
+    def plan(self, test_executable, functions, shards):
+        """
+        Longest processing time first: every function goes to the least loaded shard
+        :return: list of function lists, one per shard
+        """
+        durations = dict((function, self.expected_duration(test_executable, [function])) for function in functions)
+        plan = [[] for _ in range(max(1, min(shards, len(functions))))]
+        loads = [0.0] * len(plan)
+        for function in sorted(functions, key=lambda name: (-durations[name], name)):
+            index = loads.index(min(loads))
+            plan[index].append(function)
+            loads[index] += durations[function]
+        return plan
+
+    @classmethod
+    def report_path(cls, build_folder, test_executable, shard):
+        return os.path.join(build_folder, cls.reports_folder, "{0}.{1}.xml".format(test_executable, shard))
+
+    def record(self, test_executable, duration):
+        with self._lock:
+            self.durations[self._key(test_executable)] = duration
+
+    def merge(self, test_executable, shard_results):
+        """
+        Merges QtTest XML reports of shards to <executable>_qtest.xml in build folder and records function durations
+        :param shard_results: UnitTestResult of every shard in shard order
+        :return: UnitTestResult of whole executable
+        """
+        merged = None
+        total_msecs = 0.0
+        failed_functions = []
+        for shard in range(len(shard_results)):
+            try:
+                root = ElementTree.parse(self.report_path(self.conanfile.build_folder, test_executable,
+                                                          shard)).getroot()
+            except (IOError, OSError, ElementTree.ParseError):
+                continue  # Crashed shard, its failure is in exit code and output
+            for function in root.findall("TestFunction"):
+                name = function.get("name")
+                duration = function.find("Duration")
+                if duration is not None and name not in self._fixture_functions:
+                    with self._lock:
+                        self.durations[self._key(test_executable, name)] = float(duration.get("msecs", 0)) / 1000.0
+                if any(incident.get("type") in ["fail", "xpass"] for incident in function.findall("Incident")):
+                    failed_functions.append(name)
+            duration = root.find("Duration")
+            if duration is not None:
+                total_msecs += float(duration.get("msecs", 0))
+                root.remove(duration)
+            # Every shard runs initTestCase and cleanupTestCase, first shard ones are kept
+            cleanup = [function for function in root.findall("TestFunction")
+                       if function.get("name") == "cleanupTestCase"]
+            if merged is None:
+                merged = root
+                merged_cleanup = cleanup
+                for function in cleanup:
+                    merged.remove(function)
+            else:
+                merged.extend(function for function in root.findall("TestFunction")
+                              if function.get("name") not in self._fixture_functions)
+        if merged is not None:
+            merged.extend(merged_cleanup)
+            ElementTree.SubElement(merged, "Duration", msecs="{0:.6f}".format(total_msecs))
+            ElementTree.ElementTree(merged).write(os.path.join(self.conanfile.build_folder,
+                                                               test_executable + "_qtest.xml"),
+                                                  encoding="utf-8", xml_declaration=True)
+
+        output = "".join(result.output for result in shard_results)
+        if failed_functions:
+            output += "Failed functions: {0}\n".format(", ".join(failed_functions))
+        result = UnitTestResult(test_executable, "\n".join(result.command for result in shard_results),
+                                next((result.retcode for result in shard_results if result.retcode), 0), output,
+                                sum(result.duration for result in shard_results))
+        self.record(test_executable, result.duration)
+        return result
+
+    def save(self):
+        tools.save(self.history_path, json.dumps(self.durations, indent=1, sort_keys=True))
+
+
 class QMakeHelper(object):
     """
     A class used to build QMake-based projects
     """
 
     conanfile = None # type: ConanFile
+    qmake_fingerprint_filename = "qmake_fingerprint.txt"
+    qmake_project_extensions = (".pro", ".pri", ".prf")
+    qmake_features_folder = "qmake_features"
+    make_time_filename = "make_time.json"
+    # Replaces C++ SOURCES with unity files including UNITY_BUILD_BATCH_SIZE sources each. Unity files are rewritten
+    # only when their content changes, so unchanged batches are not recompiled. Sources from UNITY_BUILD_EXCLUDE
+    # (file names) and sources including their own .moc file stay in SOURCES, so moc, uic and rcc work as before.
+    # Only functions of qmake from Qt 5.5 are used, num_add() appeared in Qt 5.8.
+    unity_build_feature = """# Generated by CommonConanFile, do not edit
+isEmpty(UNITY_BUILD_BATCH_SIZE): UNITY_BUILD_BATCH_SIZE = 8
+# Decimal number plus one
+defineReplace(unity_build_increment) {
+    unity_build_number = $$1
+    contains(unity_build_number, "9+"): return(1$$replace(unity_build_number, 9, 0))
+    unity_build_nines = $$replace(unity_build_number, "^.*[0-8]", "")
+    unity_build_head = $$replace(unity_build_number, "[0-8]9*$", "")
+    unity_build_digit = $$replace(unity_build_number, "9*$", "")
+    unity_build_digit = $$replace(unity_build_digit, "^$$unity_build_head", "")
+    unity_build_next_digits = 1 2 3 4 5 6 7 8 9
+    return($${unity_build_head}$$member(unity_build_next_digits, $$unity_build_digit)$$replace(unity_build_nines, 9, 0))
+}
+unity_build_sources =
+unity_build_batches =
+unity_build_batch_sources =
+unity_build_index = 0
+for(unity_build_source, SOURCES) {
+    contains(UNITY_BUILD_EXCLUDE, $$basename(unity_build_source))|!contains(unity_build_source, ".*[.](cpp|cc|cxx)$") {
+        unity_build_sources += $$unity_build_source
+    } else {
+        isEmpty(unity_build_batch_sources): unity_build_batches += $$unity_build_index
+        unity_build_batch_$${unity_build_index} += "$${LITERAL_HASH}include <$$absolute_path($$unity_build_source, $$_PRO_FILE_PWD_)>"
+        unity_build_batch_sources += $$unity_build_source
+        count(unity_build_batch_sources, $$UNITY_BUILD_BATCH_SIZE) {
+            unity_build_batch_sources =
+            unity_build_index = $$unity_build_increment($$unity_build_index)
+        }
+    }
+}
+for(unity_build_batch, unity_build_batches) {
+    unity_build_file = $$OUT_PWD/unity_build/$$basename(TARGET)_unity_$${unity_build_batch}.cpp
+    unity_build_content =
+    exists($$unity_build_file): unity_build_content = $$cat($$unity_build_file, lines)
+    !equals(unity_build_content, "$$join(unity_build_batch_$${unity_build_batch}, " ")") {
+        !write_file($$unity_build_file, unity_build_batch_$${unity_build_batch}): error("Cannot write $$unity_build_file")
+    }
+    unity_build_sources += $$unity_build_file
+}
+SOURCES = $$unity_build_sources
+"""
+    _moc_include = re.compile(r"^\s*#\s*include\s*[<\"][^>\"]+\.moc[>\"]", re.MULTILINE)
 
     def __init__(self, conanfile):
         """
@@ -409,6 +2332,11 @@ class QMakeHelper(object):
         """
         self.conanfile = conanfile
         self._make_program = tools.get_env("CONAN_MAKE_PROGRAM", "make")
+        self._profiler = BuildProfiler.of(conanfile)
+        self._job_scheduler = MakeJobScheduler.from_environment(conanfile)
+        self._use_ccache = platform in ["linux", "linux2", "darwin"] and \
+            tools.get_env("CONAN_QMAKE_CCACHE", True) and tools.which("ccache") is not None
+        self._output_lock = threading.Lock()
     
     def get_version_str(self):
         build_id = tools.get_env("CI_PIPELINE_ID", "0")
@@ -421,7 +2349,7 @@ class QMakeHelper(object):
         return version_str
 
     def clean(self):
-        self.conanfile.run(self._make_program + " clean")
+        self._profiler.run("make clean", self._make_program + " clean")
 
     def build(self, project_filename, with_clean=False, with_coverage=False):
         """
@@ -450,16 +2378,54 @@ class QMakeHelper(object):
         if "shared" in self.conanfile.options.fields and not self.conanfile.options.shared:
             configs_builder.append_keys_current.append("staticlib")
 
+        ccache_stats = None
+        if self._use_ccache:
+            configs_builder.add_special_case_parameters("ccache")
+            ccache_stats = self._ccache_stats()
+
+        pch_path = None
+        make_env = {}
+        if "pch" in self.conanfile.options.fields and self.conanfile.options.pch:
+            pch_path = PrecompiledHeaderGenerator(self.conanfile).generate()
+            if pch_path:
+                configs_builder.add_special_case_parameters("pch")
+                pch_builder = QMakePrecompiledHeaderBuilder(conanfile=self.conanfile)
+                pch_builder.append_keys_current.append(pch_path)
+                list_builders.append(pch_builder)
+                # ccache does not cache compilations using precompiled header without these
+                make_env["CCACHE_SLOPPINESS"] = "pch_defines,time_macros,include_file_mtime,include_file_ctime"
+
+        if "unity_build" in self.conanfile.options.fields and self.conanfile.options.unity_build:
+            configs_builder.add_special_case_parameters("unity_build")
+            batch_size_builder = QMakeUnityBuildBatchSizeBuilder(conanfile=self.conanfile)
+            batch_size_builder.append_keys_current.append(str(self.conanfile.unity_build_batch_size))
+            exclude_builder = QMakeUnityBuildExcludeBuilder(conanfile=self.conanfile)
+            exclude_builder.append_keys_current.extend(self._unity_build_exclude())
+            list_builders.append(batch_size_builder)
+            list_builders.append(exclude_builder)
+            # make reruns qmake when project files change, so feature must be found by make too
+            make_env["QMAKEFEATURES"] = [self._write_unity_build_feature()]
+
+        cflags_builder = QMakeCFlagsBuilder(conanfile=self.conanfile)
+        lflags_builder = QMakeLFlagsBuilder(conanfile=self.conanfile)
+
         if with_coverage:
             cxxflags_builder.add_special_case_parameters("coverage")
 
             lib_builder = QMakeLibBuilder(conanfile=self.conanfile)
             lib_builder.add_special_case_parameters("coverage")
-            cflags_builder = QMakeCFlagsBuilder(conanfile=self.conanfile)
             cflags_builder.add_special_case_parameters("coverage")
 
             list_builders.append(lib_builder)
-            list_builders.append(cflags_builder)
+
+        if "fast_link" in self.conanfile.options.fields and self.conanfile.options.fast_link:
+            for tag in self._fast_link_tags(with_coverage):
+                for builder in [cxxflags_builder, cflags_builder, lflags_builder]:
+                    builder.add_special_case_parameters(tag)
+
+        for builder in [cflags_builder, lflags_builder]:
+            if builder.append_keys_current:
+                list_builders.append(builder)
 
         qmake_command = " ".join([
             "qmake",
@@ -470,32 +2436,234 @@ class QMakeHelper(object):
 
         self.conanfile.output.info("QMake command: " + qmake_command)
 
-        self.conanfile.run(qmake_command)
-        self.conanfile.run(self._make_program + " -j" + str(tools.cpu_count()))
+        with tools.environment_append(make_env):
+            fingerprint = self._qmake_fingerprint(qmake_command)
+            fingerprint_path = os.path.join(self.conanfile.build_folder, self.qmake_fingerprint_filename)
+            if os.path.isfile(os.path.join(self.conanfile.build_folder, "Makefile")) and \
+                    os.path.isfile(fingerprint_path) and tools.load(fingerprint_path) == fingerprint:
+                self.conanfile.output.info("QMake configuration not changed, qmake skipped")
+            else:
+                tools.save(fingerprint_path, "")  # Invalidate in case qmake fails
+                self._profiler.run("qmake", qmake_command)
+                tools.save(fingerprint_path, fingerprint)
+        objects = self._make_objects()
+        full_build = bool(objects) and not any(os.path.exists(os.path.join(self.conanfile.build_folder, path))
+                                                for path in objects)
+        make_start = time.time()
+        with self._job_scheduler.reserve() as jobs, tools.environment_append(make_env):
+            self._profiler.run("make", " ".join([self._make_program, self._job_scheduler.make_arguments(jobs)]))
+        if full_build:
+            self._report_make_time(project_filename, pch_path is not None, time.time() - make_start)
+
+        if self._use_ccache:
+            self._report_ccache_stats(ccache_stats)
 
         if with_clean:
             self.clean()
 
+    def _qmake_fingerprint(self, qmake_command):
+        """
+        Hash of everything qmake output depends on: command line, qmake executable and spec environment, project
+            files of source folder, imported build_modules and conan generated pri
+        :param qmake_command: full qmake command line
+        :return: hex digest string
+        """
+        fingerprint = hashlib.sha1()
+        for value in [qmake_command, tools.which("qmake") or "",
+                      os.getenv("QMAKESPEC", ""), os.getenv("QMAKEPATH", ""), os.getenv("QMAKEFEATURES", "")]:
+            fingerprint.update(value.encode("utf-8") + b"\0")
+
+        project_files = []
+        for folder in [self.conanfile.source_folder, os.path.join(self.conanfile.build_folder, "build_modules"),
+                       os.path.join(self.conanfile.build_folder, self.qmake_features_folder)]:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [name for name in dirs if not name.startswith(".")]
+                project_files.extend(os.path.join(root, filename) for filename in files
+                                     if filename.endswith(self.qmake_project_extensions))
+        project_files.append(os.path.join(self.conanfile.build_folder, "conanbuildinfo.pri"))
+
+        for project_file in sorted(set(project_files)):
+            if os.path.isfile(project_file):
+                fingerprint.update(project_file.encode("utf-8") + b"\0")
+                with open(project_file, "rb") as project_file_content:
+                    fingerprint.update(hashlib.sha1(project_file_content.read()).digest())
+        return fingerprint.hexdigest()
+
+    def _fast_link_tags(self, with_coverage):
+        """
+        Chooses fast link special cases for current build: lld, then gold linker if installed and supported by
+            compiler, compressed debug sections for debug and coverage builds. Split DWARF is used for coverage
+            builds only: their binaries are not packaged, while .dwo files of packaged binaries would stay in build
+            folder. Coverage data does not depend on debug info, so gcov results are the same.
+        :param with_coverage: unit test build
+        :return: list of builder special case tags
+        """
+        if str(self.conanfile.settings.os) != "Linux":
+            self.conanfile.output.warn("fast_link is supported on Linux only")
+            return []
+
+        tags = []
+        compiler = str(self.conanfile.settings.compiler)
+        compiler_version = str(self.conanfile.settings.get_safe("compiler.version") or "0")
+        if compiler == "clang" or compiler == "gcc" and int(compiler_version.split(".")[0]) >= 9:
+            if tools.which("ld.lld"):
+                tags.append("fast_link_lld")
+        if not tags and compiler in ["gcc", "clang"] and tools.which("ld.gold"):
+            tags.append("fast_link_gold")
+        if with_coverage or str(self.conanfile.settings.build_type) == "Debug":
+            tags.append("compressed_debug")
+        if with_coverage:
+            tags.append("split_dwarf")
+
+        self.conanfile.output.info("Fast link: " + (", ".join(tags) if tags else "no faster linker found"))
+        return tags
+
+    def _write_unity_build_feature(self):
+        """
+        Writes unity_build.prf to build folder if it is missing or outdated
+        :return: features folder for QMAKEFEATURES
+        """
+        features_folder = os.path.join(self.conanfile.build_folder, self.qmake_features_folder)
+        feature_path = os.path.join(features_folder, "unity_build.prf")
+        if not os.path.isfile(feature_path) or tools.load(feature_path) != self.unity_build_feature:
+            tools.save(feature_path, self.unity_build_feature)
+        return features_folder
+
+    def _unity_build_exclude(self):
+        """
+        :return: file names of sources excluded from unity build: unity_build_exclude of recipe and sources including
+            .moc file, as moc output for them is generated only for sources listed in SOURCES
+        """
+        exclude = set(self.conanfile.unity_build_exclude)
+        for root, dirs, files in os.walk(self.conanfile.source_folder):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            for filename in files:
+                if filename.endswith((".cpp", ".cc", ".cxx")) and filename not in exclude:
+                    with open(os.path.join(root, filename), "r", errors="replace") as source:
+                        if self._moc_include.search(source.read()):
+                            exclude.add(filename)
+        if exclude:
+            self.conanfile.output.info("Compiled separately in unity build: " + " ".join(sorted(exclude)))
+        return sorted(exclude)
+
+    def _ccache_stats(self):
+        """
+        :return: dict of ccache counters or None if ccache is too old for --print-stats (before 4.0)
+        """
+        buf = StringIO()
+        if self._profiler.run("ccache stats", "ccache --print-stats", output=buf, ignore_errors=True) != 0:
+            return None
+        stats = {}
+        for line in buf.getvalue().splitlines():
+            fields = line.split("\t")
+            if len(fields) == 2 and fields[1].strip().isdigit():
+                stats[fields[0].strip()] = int(fields[1])
+        return stats
+
+    def _make_objects(self):
+        """
+        :return: object files of OBJECTS list of Makefile written by qmake, relative to build folder. Empty if
+            Makefile has no such list, like top Makefile of debug_and_release builds
+        """
+        makefile = os.path.join(self.conanfile.build_folder, "Makefile")
+        if not os.path.isfile(makefile):
+            return []
+        match = re.search(r"^OBJECTS\s*=((?:.*\\\n)*.*)$", tools.load(makefile), re.MULTILINE)
+        if not match:
+            return []
+        return match.group(1).replace("\\\n", " ").split()
+
+    def _report_make_time(self, project_filename, with_pch, seconds):
+        """
+        Stores make time of full build of project and prints it against last full build with the other pch setting.
+            Incremental builds are not stored, their time depends on what changed
+        :param project_filename: .pro file
+        :param with_pch: if build used precompiled header
+        :param seconds: make wall time
+        """
+        make_time_path = os.path.join(self.conanfile.build_folder, self.make_time_filename)
+        make_time = {}
+        if os.path.isfile(make_time_path):
+            try:
+                make_time = json.loads(tools.load(make_time_path))
+            except ValueError:
+                pass
+        project_make_time = make_time.setdefault(project_filename, {})
+        project_make_time["pch" if with_pch else "no_pch"] = seconds
+        tools.save(make_time_path, json.dumps(make_time, indent=1, sort_keys=True))
+        if "pch" in project_make_time and "no_pch" in project_make_time:
+            pch_time = project_make_time["pch"]
+            no_pch_time = project_make_time["no_pch"]
+            self.conanfile.output.info("Measured full make time of {0}: {1:.1f}s with precompiled header, {2:.1f}s "
+                                       "without ({3:+.0f}%)".format(project_filename, pch_time, no_pch_time,
+                                                                    (pch_time - no_pch_time) * 100.0 / no_pch_time
+                                                                    if no_pch_time else 0))
+
+    def _report_ccache_stats(self, stats_before):
+        """
+        Prints ccache hits and misses of the build. Counters are global for cache, so concurrent builds on the same
+            agent are counted too.
+        :param stats_before: counters taken before build
+        :return:
+        """
+        stats_after = self._ccache_stats()
+        if stats_before is None or stats_after is None:
+            self._profiler.run("ccache stats", "ccache -s")
+            return
+
+        def delta(*keys):
+            return sum(stats_after.get(key, 0) - stats_before.get(key, 0) for key in keys)
+
+        hits = delta("direct_cache_hit", "preprocessed_cache_hit")
+        misses = delta("cache_miss")
+        hit_rate = 100.0 * hits / (hits + misses) if hits + misses else 0.0
+        self.conanfile.output.info("ccache: {0} hits, {1} misses, {2:.1f}% hit rate".format(hits, misses, hit_rate))
+
     def build_project(self, project_name, with_coverage=False):
         self.build(project_name + ".pro", with_clean=False, with_coverage=with_coverage)
 
-    def build_unit_test(self, project_name):
+    def build_unit_test(self, project_name, incremental=False, with_coverage=True):
+        """
+        Builds unit tests project with coverage
+        :param project_name:
+        :param incremental: keep object files for next build instead of make clean. Coverage run data of previous
+            run is removed instead, so counters do not accumulate between runs.
+        :param with_coverage:
+        :return:
+        """
         legacy_filename = project_name + "_TestPrivate.pro"
         modern_filename = project_name + "_TestUnit.pro"
 
         if os.path.isfile(os.sep.join([self.conanfile.source_folder, legacy_filename])):
-            self.build(legacy_filename, True, True)
+            self.build(legacy_filename, not incremental, with_coverage)
         elif os.path.isfile(os.sep.join([self.conanfile.source_folder, modern_filename])):
-            self.build(modern_filename, True, True)
+            self.build(modern_filename, not incremental, with_coverage)
         else:
             raise NotCriticalException("No Unit tests project file found")
 
-    def run_unit_test(self, project_name, test_executable_name=None, is_headless=True):
+        if incremental:
+            for root, _, files in os.walk(self.conanfile.build_folder):
+                for filename in files:
+                    if filename.endswith(".gcda"):
+                        os.remove(os.path.join(root, filename))
+
+    def run_unit_test(self, project_name, test_executable_name=None, is_headless=True, jobs=None,
+                      isolated_displays=False, incremental=False, with_coverage=True, use_cache=False, shards=1):
         """
-        Function that builds and runs unit tests one by one
+        Function that builds and runs unit tests. Executables are distributed over a pool of workers, output of every
+            executable is captured separately and printed as a whole when it finishes.
+            With shards test functions of every executable are listed with -functions and run in up to shards
+            concurrent processes, longest first according to durations of previous runs (QtTestSharding).
         :param project_name: Project name needed to define .pro file for building
         :param test_executable_name: list of executables or just name of on executable for running.
         :param is_headless:
+        :param jobs: number of executables running at once. Default is tools.cpu_count()
+        :param isolated_displays: start own Xvfb server for every worker instead of one shared by all tests
+        :param incremental: keep object files of unit tests build between runs
+        :param with_coverage: build tests with coverage
+        :param use_cache: skip executables passed before with the same fingerprint (UnitTestCache). Ignored with
+            coverage, as counters of skipped tests would be missed. CONAN_UNIT_TEST_FORCE_RUN forces full run.
+        :param shards: number of concurrent runs of every executable, 1 runs executable as a whole
         :return:
         """
         if test_executable_name is None:
@@ -505,23 +2673,318 @@ class QMakeHelper(object):
             self.conanfile.output.info("Wrap unit test executable in list")
             test_executable_name = [test_executable_name]
 
-        self.build_unit_test(project_name)
+        self.build_unit_test(project_name, incremental, with_coverage)
         self.conanfile.output.info("Unit test building finished")
         env_build = RunEnvironment(self.conanfile)
 
+        cache = None
+        if use_cache and with_coverage:
+            self.conanfile.output.info("Unit test cache is not used for coverage run")
+        elif use_cache and tools.get_env("CONAN_UNIT_TEST_FORCE_RUN", False):
+            self.conanfile.output.info("Unit test cache is ignored, full run forced with CONAN_UNIT_TEST_FORCE_RUN")
+        elif use_cache:
+            cache = UnitTestCache(self.conanfile, env_build.vars, is_headless)
+
+        sharding = QtTestSharding(self.conanfile) if shards > 1 else None
+
+        if jobs is None:
+            jobs = tools.cpu_count()
+        jobs = max(1, min(int(jobs), len(test_executable_name) * max(1, shards)))
+        self.conanfile.output.info("Running {0} unit test executables with {1} workers".format(
+            len(test_executable_name), jobs))
+
+        is_headless = is_headless is True and platform in [ "linux", "linux2", "darwin" ]
+        use_xvfb_run = False
+        if is_headless and not tools.which("Xvfb"):
+            self.conanfile.output.warn("Xvfb not found, every test will start own server with xvfb-run")
+            use_xvfb_run = True
+
+        with tools.environment_append(env_build.vars), \
+                XvfbDisplayPool(self.conanfile, jobs if isolated_displays else 1,
+                                enabled=is_headless and not use_xvfb_run) as displays:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                plans = list(executor.map(lambda current_test_executable:
+                                          self._plan_test_executable(current_test_executable, is_headless, displays,
+                                                                     use_xvfb_run, cache, sharding, shards),
+                                          test_executable_name))
+                # (executable, functions or None for all, shard, shards count)
+                tasks = [(current_test_executable, functions, shard, len(plan[1]))
+                         for current_test_executable, plan in zip(test_executable_name, plans)
+                         if not isinstance(plan, UnitTestResult)
+                         for shard, functions in enumerate(plan[1])]
+                if sharding is not None:
+                    # Longest first, so long runs do not end up at the tail
+                    tasks.sort(key=lambda task: -sharding.expected_duration(task[0], task[1]))
+                task_results = list(executor.map(lambda task: self._run_test_executable(task[0], is_headless,
+                                                                                        displays, use_xvfb_run,
+                                                                                        task[1], task[2], task[3]),
+                                                 tasks))
+
+        results = []
+        for current_test_executable, plan in zip(test_executable_name, plans):
+            if isinstance(plan, UnitTestResult):
+                results.append(plan)
+                continue
+            shard_results = [result for task, result in sorted(zip(tasks, task_results), key=lambda item: item[0][2])
+                             if task[0] == current_test_executable]
+            if sharding is not None and plan[1] != [None]:
+                result = sharding.merge(current_test_executable, shard_results)
+            else:
+                result = shard_results[0]
+                if sharding is not None:
+                    sharding.record(current_test_executable, result.duration)
+            if cache is not None:
+                cache.store(result, plan[0])
+            results.append(result)
+        if cache is not None:
+            cache.save()
+        if sharding is not None:
+            sharding.save()
+
+        UnitTestResult.report(self.conanfile, results)
+
+    def _test_command(self, test_executable, is_headless, display, use_xvfb_run, arguments=""):
+        """
+        :return: command line running test executable on display
+        """
         prefix = ""
         postfix = ""
-        if is_headless is True and platform in [ "linux", "linux2", "darwin" ]:
-            prefix = "xvfb-run --server-args='-screen 0 640x480x24'"
+        if is_headless:
+            if use_xvfb_run:
+                # -a makes xvfb-run look for a free display number, so every worker gets its own virtual display
+                prefix = "xvfb-run -a --server-args='-screen 0 {0}'".format(XvfbDisplayPool.screen)
+            else:
+                prefix = "DISPLAY=" + display
             postfix = "-platform minimal"
 
-        with tools.environment_append(env_build.vars):
-            for current_test_executable in test_executable_name:
-                run_command = " ".join([
-                    prefix,
-                    os.sep.join([".", current_test_executable]),
-                    postfix
-                ])
-                self.conanfile.output.info("Run test command: " + run_command)
-                self.conanfile.run(run_command)
+        return " ".join([
+            prefix,
+            os.sep.join([".", test_executable]),
+            postfix,
+            arguments
+        ])
+
+    def _plan_test_executable(self, test_executable, is_headless, displays, use_xvfb_run, cache, sharding, shards):
+        """
+        :param cache: UnitTestCache to skip test passed before with the same fingerprint
+        :param sharding: QtTestSharding to split test functions with or None
+        :param shards: number of shards
+        :return: cached UnitTestResult or (fingerprint, list of shards function lists, [None] to run whole executable)
+        """
+        fingerprint = None
+        if cache is not None:
+            fingerprint = cache.fingerprint(os.path.join(self.conanfile.build_folder, test_executable))
+            result = cache.lookup(test_executable, fingerprint)
+            if result is not None:
+                with self._output_lock:
+                    self.conanfile.output.success("{0} passed before with the same fingerprint, skipped".format(
+                        test_executable))
+                return result
+        if sharding is None:
+            return fingerprint, [None]
+
+        with displays.acquire() as display:
+            command = self._test_command(test_executable, is_headless, display, use_xvfb_run, "-functions")
+            buf = StringIO()
+            retcode = self._profiler.run("unit test functions " + test_executable, command, output=buf,
+                                         ignore_errors=True)
+        functions = QtTestSharding.parse_functions(buf.getvalue()) if retcode == 0 else []
+        if not functions:
+            with self._output_lock:
+                self.conanfile.output.warn("Test functions of {0} not listed, it is run as a whole".format(
+                    test_executable))
+            return fingerprint, [None]
+        return fingerprint, sharding.plan(test_executable, functions, shards)
+
+    def _run_test_executable(self, test_executable, is_headless, displays, use_xvfb_run=False, functions=None,
+                             shard=0, shards=1):
+        """
+        Runs one unit test executable with captured output
+        :param test_executable: name of executable in build folder
+        :param is_headless:
+        :param displays: XvfbDisplayPool to take display from
+        :param use_xvfb_run: wrap test in xvfb-run instead of using display from pool
+        :param functions: QtTest functions to run, None runs all of them without XML report
+        :param shard: index of shard, XML report is written to QtTestSharding.report_path
+        :param shards: number of shards of executable
+        :return: UnitTestResult
+        """
+        name = test_executable
+        arguments = ""
+        if functions is not None:
+            name = "{0} [{1}/{2}]".format(test_executable, shard + 1, shards)
+            report_path = QtTestSharding.report_path(self.conanfile.build_folder, test_executable, shard)
+            tools.mkdir(os.path.dirname(report_path))
+            if os.path.isfile(report_path):
+                os.remove(report_path)
+            arguments = " ".join(["-o", report_path + ",xml", "-o", "-,txt"] + functions)
+
+        with displays.acquire() as display:
+            run_command = self._test_command(test_executable, is_headless, display, use_xvfb_run, arguments)
+
+            buf = StringIO()
+            start = time.time()
+            retcode = self._profiler.run("unit test " + name, run_command, output=buf, ignore_errors=True)
+            result = UnitTestResult(name, run_command, retcode, buf.getvalue(), time.time() - start)
+
+        with self._output_lock:
+            self.conanfile.output.info("Run test command: " + run_command)
+            self.conanfile.output.write(result.output)
+            if result.passed:
+                self.conanfile.output.success("{0} passed in {1:.2f}s".format(name, result.duration))
+            else:
+                self.conanfile.output.error("{0} failed with exit code {1}".format(name, result.retcode))
+        return result
+
+
+# =================================================================================================
+# =================================================================================================
+
+# CMake build helper
+
+
+class CMakeHelper(object):
+    """
+    A class used to build CMake-based projects and run their tests with ctest
+    """
 
+    conanfile = None # type: ConanFile
+    ctest_report_filename = "ctest_results.xml"
+    # Same flags as in qmake coverage builds, so coverage() handles both
+    coverage_compiler_flags = QMakeCxxFlagsBuilder.append_keys["coverage"]
+    coverage_linker_flags = ["--coverage"]
+    # "  1/12 Test  #3: tst_parser .......................***Failed    0.05 sec"
+    _ctest_result_line = re.compile(r"^\s*\d+/\d+\s+Test\s+#\d+:\s+(\S+)\s+\.*\s*(.*?)\s+([\d.]+)\s+sec\s*$",
+                                    re.MULTILINE)
+
+    def __init__(self, conanfile):
+        """
+        :param conanfile:
+        :type conanfile: ConanFile
+        """
+        self.conanfile = conanfile
+        self._profiler = BuildProfiler.of(conanfile)
+        self._job_scheduler = MakeJobScheduler.from_environment(conanfile)
+
+    def build(self, with_coverage=False, with_tests=False):
+        """
+        Configures and builds project. Ninja is used if it is installed and CONAN_CMAKE_GENERATOR is not set,
+            number of jobs is taken from MakeJobScheduler like for qmake builds
+        :param with_coverage: add compiler and linker flags for tests coverage
+        :param with_tests: configure with BUILD_TESTING
+        :return:
+        """
+        generator = None
+        if not tools.get_env("CONAN_CMAKE_GENERATOR") and tools.which("ninja"):
+            generator = "Ninja"
+        # Visual Studio generators do not take make-like job arguments
+        native_jobs = generator == "Ninja" or not tools.os_info.is_windows
+        cmake = CMake(self.conanfile, generator=generator, parallel=not native_jobs)
+
+        for definition_key in self.conanfile.cmake_definitions:
+            cmake.definitions[definition_key] = self.conanfile.cmake_definitions[definition_key]
+        if with_tests:
+            cmake.definitions["BUILD_TESTING"] = "ON"
+        if with_coverage:
+            for flags_name, flags in [("CMAKE_C_FLAGS", self.coverage_compiler_flags),
+                                      ("CMAKE_CXX_FLAGS", self.coverage_compiler_flags),
+                                      ("CMAKE_EXE_LINKER_FLAGS", self.coverage_linker_flags),
+                                      ("CMAKE_SHARED_LINKER_FLAGS", self.coverage_linker_flags)]:
+                cmake.definitions[flags_name] = " ".join([str(cmake.definitions.get(flags_name, ""))] + flags).strip()
+
+        self.conanfile.output.info("CMake generator: " + (generator or "default"))
+        with self._profiler.phase("cmake configure", generator or "default generator"):
+            cmake.configure()
+        # Only make takes jobs from make jobserver, ninja gets them for the whole build
+        with self._job_scheduler.reserve(jobserver="Makefiles" in str(cmake.generator)) as jobs:
+            if jobs is None:
+                # cmake.build quotes arguments, jobserver FIFO is opened by shell redirection in command itself
+                self._profiler.run("cmake build", " ".join(["cmake --build", "\"" + self.conanfile.build_folder + "\"",
+                                                            cmake.build_config, "--",
+                                                            self._job_scheduler.make_arguments(jobs)]))
+            else:
+                arguments = ["--"] + self._job_scheduler.make_arguments(jobs).split() if native_jobs else None
+                with self._profiler.phase("cmake build", " ".join(arguments or [])):
+                    cmake.build(args=arguments)
+
+    def cmake_version(self):
+        """
+        :return: tuple of ints, (0,) if unknown
+        """
+        buf = StringIO()
+        self.conanfile.run("cmake --version", output=buf, ignore_errors=True)
+        version = re.search(r"version\s+(\d+)\.(\d+)", buf.getvalue())
+        return tuple(int(number) for number in version.groups()) if version else (0,)
+
+    def run_unit_test(self, is_headless=True, jobs=None, with_coverage=True):
+        """
+        Builds project with tests and coverage and runs registered tests with ctest -j. Per test results are taken
+            from ctest JUnit report (CMake 3.21+) or from ctest output and written to common unit test report.
+        :param is_headless: run tests with minimal Qt platform on virtual display
+        :param jobs: number of tests running at once. Default is tools.cpu_count()
+        :param with_coverage: build tests with coverage
+        :return:
+        """
+        self.build(with_coverage=with_coverage, with_tests=True)
+        self.conanfile.output.info("Unit test building finished")
+
+        if jobs is None:
+            jobs = tools.cpu_count()
+        report_path = os.path.join(self.conanfile.build_folder, self.ctest_report_filename)
+        if os.path.isfile(report_path):
+            os.remove(report_path)
+        command = ["ctest", "--output-on-failure", "-j", str(jobs)]
+        # Multi-config generators (Visual Studio) do not run tests without configuration
+        build_type = self.conanfile.settings.get_safe("build_type")
+        if build_type:
+            command += ["-C", str(build_type)]
+        if self.cmake_version() >= (3, 21):
+            command += ["--output-junit", report_path]
+        command = " ".join(command)
+
+        is_headless = is_headless is True and platform in ["linux", "linux2", "darwin"]
+        # Without Xvfb tests still run with minimal platform
+        use_xvfb = is_headless and tools.which("Xvfb") is not None
+        env_build = RunEnvironment(self.conanfile)
+        buf = StringIO()
+        start = time.time()
+        with tools.environment_append(env_build.vars), \
+                XvfbDisplayPool(self.conanfile, 1, enabled=use_xvfb) as displays, displays.acquire() as display:
+            env_display = {}
+            if is_headless:
+                env_display["QT_QPA_PLATFORM"] = "minimal"
+                if display:
+                    env_display["DISPLAY"] = display
+            with tools.environment_append(env_display):
+                self.conanfile.output.info("Run test command: " + command)
+                retcode = self._profiler.run("ctest", command, output=buf, ignore_errors=True)
+        output = buf.getvalue()
+        self.conanfile.output.write(output)
+
+        if os.path.isfile(report_path):
+            results = self._junit_results(report_path, command)
+        else:
+            results = [UnitTestResult(name, command, 0 if status == "Passed" else 1, "", float(duration))
+                       for name, status, duration in self._ctest_result_line.findall(output)]
+        if not results and retcode == 0:
+            raise NotCriticalException("No tests registered with add_test found by ctest")
+        if retcode != 0 and all(result.passed for result in results):
+            # ctest itself failed, e.g. test executable is missing
+            results.append(UnitTestResult("ctest", command, retcode, output, time.time() - start))
+        UnitTestResult.report(self.conanfile, results)
+
+    @staticmethod
+    def _junit_results(report_path, command):
+        """
+        :param report_path: JUnit report written by ctest --output-junit
+        :param command: ctest command
+        :return: list of UnitTestResult
+        """
+        results = []
+        for testcase in ElementTree.parse(report_path).getroot().iter("testcase"):
+            failed = testcase.get("status") in ["fail", "notrun"] or testcase.find("failure") is not None or \
+                testcase.find("error") is not None
+            output = testcase.findtext("system-out") or ""
+            results.append(UnitTestResult(testcase.get("name"), command, 1 if failed else 0, output,
+                                          float(testcase.get("time") or 0)))
+        return results
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Conan install tools for Qt Creator: external tools generation and concurrent install of the whole matrix.
+
+generate writes "Conan (Qt Creator ...)/<OS>/*.xml" external tools of every Qt Creator variant from one template.
+install runs conan install for every project part (project, sample, test_package), build type and DEV/PROD
+channel at once with a bounded pool. Graph of every part and channel is resolved once into a base lockfile
+(conan lock create --base), build types are installed from it. Without lockfile support of conan every cell is
+installed as external tools do.
+
+Usage:
+    python qtc_conan.py generate                                   # rewrite external tools in this repo
+    python qtc_conan.py install ~/src/project                      # Debug and Release, DEV and PROD
+    python qtc_conan.py install ~/src/project -c dev -b Debug -t project -t test_package -pr qt5.15.2
+    python qtc_conan.py install ~/src/project --conan benchmarks/stubs/bin/conan   # dry run with stub conan
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+REPO_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Project parts: name in tool title, subfolder of project, tool id per channel
+TARGETS = OrderedDict([
+    ("project", {"title": "Project", "folder": "", "id": "Conan_Install_{Channel}"}),
+    ("sample", {"title": "Sample", "folder": "sample", "id": "Conan_Install_Sample_{Channel}"}),
+    ("test_package", {"title": "Test Public", "folder": "test_package",
+                      "id": "{CHANNEL}_Conan_Install_for_Test_Public"}),
+])
+
+# Channel -> conan install environment
+CHANNELS = OrderedDict([
+    ("dev", {"OVERRIDE_CONAN_CHANNEL": "dev"}),
+    ("prod", {}),
+])
+
+BUILD_TYPES = ["Debug", "Release"]
+
+
+# =================================================================================================
+# External tools
+# =================================================================================================
+
+# Qt Creator variables changed in 4.14, tools for older versions use deprecated ones
+QT_CREATOR_VARIANTS = OrderedDict([
+    ("Conan (Qt Creator before 4.13)", {
+        "build_path": "%{CurrentProject:BuildPath}",
+        "project_path": "%{CurrentProject:Path}",
+        "build_type": 'if ("%{CurrentBuild:Type}" == "release") "Release"; else "Debug"',
+        "kit_condition": '"%{{CurrentKit:Id}}" == "{kit_id}"',
+    }),
+    ("Conan (Qt Creator from 4.14)", {
+        "build_path": "%{ActiveProject:BuildConfig:Path}",
+        "project_path": "%{ActiveProject:Path}",
+        "build_type": 'if ("%{ActiveProject:BuildConfig:Type}" == "debug") "Debug"; else "Release"',
+        "kit_condition": '"%{{ActiveProject:Kit:Name}}".includes("{kit_name}")',
+    }),
+])
+
+PLATFORMS = OrderedDict([
+    ("Linux", {"separator": "/", "category": "Conan {CHANNEL}", "with_profile": False}),
+    ("Windows", {"separator": "\\", "category": "Conan", "with_profile": True}),
+])
+
+# Windows kits: kit id (before 4.13), part of kit name (from 4.14), conan profile
+KITS = [
+    ("qt.qt5.598.win32_mingw53_kit", "Qt 5.9.8 MinGW", "qt5.9.8"),
+    ("qt.qt5.5132.win32_mingw73_kit", "Qt 5.13.2 MinGW", "qt5.13.2"),
+    ("qt.qt5.5132.win32_msvc2017_kit", "Qt 5.13.2 MSVC2017", "qt5.13.2.msvc"),
+    ("qt.qt5.5152.win32_mingw81_kit", "Qt 5.15.2 MinGW", "qt5.15.2"),
+    ("qt.qt5.5152.win32_msvc2019_kit", "Qt 5.15.2 MSVC2019", "qt5.15.2.msvc"),
+    ("qt.55.win32_mingw492_kit", "Qt 5.5.1 MinGW", "default"),
+]
+
+TOOL_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<!--Generated by qtc_conan.py generate, do not edit-->
+<externaltool id="{id}">
+    <description>{title}</description>
+    <displayname>{title}</displayname>
+    <category>{category}</category>
+    <executable output="showinpane" error="showinpane" modifiesdocument="no">
+        <path>conan</path>
+        <arguments>{arguments}</arguments>
+    </executable>
+</externaltool>
+"""
+
+
+def profile_expression(variant):
+    conditions = ["if ({0}) \"{1}\"".format(variant["kit_condition"].format(kit_id=kit_id, kit_name=kit_name),
+                                           profile)
+                  for kit_id, kit_name, profile in KITS]
+    return "%{JS:" + "; else ".join(conditions) + "; else \"default\"}"
+
+
+def tool_arguments(variant, platform, target, channel):
+    folder = TARGETS[target]["folder"]
+    suffix = platform["separator"] + folder if folder else ""
+    arguments = ["install",
+                 "-if", '"{0}{1}"'.format(variant["build_path"], suffix),
+                 '"{0}{1}"'.format(variant["project_path"], suffix),
+                 "--build=never",
+                 "-s", "build_type=%{JS:" + variant["build_type"] + "}"]
+    for name, value in CHANNELS[channel].items():
+        arguments += ["-e", "{0}={1}".format(name, value)]
+    arguments.append("-u")
+    if platform["with_profile"]:
+        arguments += ["-pr", profile_expression(variant)]
+    return " ".join(arguments)
+
+
+def generate(output_folder):
+    """
+    Writes external tools of every Qt Creator variant, platform, project part and channel
+    :return: list of written files
+    """
+    written = []
+    for variant_folder, variant in QT_CREATOR_VARIANTS.items():
+        for platform_name, platform in PLATFORMS.items():
+            folder = os.path.join(output_folder, variant_folder, platform_name)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            for channel in CHANNELS:
+                for target, target_info in TARGETS.items():
+                    title = "{0} Conan Install for {1}".format(channel.upper(), target_info["title"])
+                    names = {"CHANNEL": channel.upper(), "Channel": channel.capitalize()}
+                    content = TOOL_TEMPLATE.format(
+                        id=target_info["id"].format(**names),
+                        title=title,
+                        category=platform["category"].format(**names),
+                        arguments=escape(tool_arguments(variant, platform, target, channel), {'"': "&quot;"}))
+                    path = os.path.join(folder, title.replace(" ", "_") + ".xml")
+                    with open(path, "w", encoding="utf-8", newline="\n") as tool_file:
+                        tool_file.write(content)
+                    written.append(path)
+    return written
+
+
+# =================================================================================================
+# Install matrix
+# =================================================================================================
+
+class Cell(object):
+    """
+    One conan install: project part, channel and build type
+    """
+
+    def __init__(self, target, channel, build_type, recipe_folder, install_folder):
+        self.target = target
+        self.channel = channel
+        self.build_type = build_type
+        self.recipe_folder = recipe_folder
+        self.install_folder = install_folder
+        self.retcode = None
+        self.output = ""
+        self.duration = 0.0
+
+
+class InstallMatrix(object):
+    """
+    Runs conan install for all cells with a bounded pool. Base lockfile of every project part and channel is created
+        first, so remotes are checked and versions are resolved once, then every build type is locked from it and
+        installed with --build=never like external tools do.
+    """
+
+    def __init__(self, conan, profile=None, jobs=None, update=True):
+        """
+        :param conan: conan executable
+        :param profile: conan profile for every install
+        :param jobs: installs running at once
+        :param update: check remotes for newer packages (-u)
+        """
+        self.conan = conan
+        self.profile = profile
+        self.jobs = jobs or min(8, os.cpu_count() or 1)
+        self.update = update
+        self.lock_folder = None
+
+    def _run(self, arguments, channel):
+        """
+        :return: (exit code, output, duration)
+        """
+        env = dict(os.environ)
+        env.update(CHANNELS[channel])
+        start = time.time()
+        process = subprocess.run([self.conan] + arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 env=env, universal_newlines=True)
+        output = "$ {0}\n{1}".format(" ".join([self.conan] + arguments), process.stdout)
+        return process.returncode, output, time.time() - start
+
+    def _profile_arguments(self, channel):
+        arguments = ["-pr", self.profile] if self.profile else []
+        for name, value in CHANNELS[channel].items():
+            arguments += ["-e", "{0}={1}".format(name, value)]
+        return arguments
+
+    def _base_lock(self, target, channel, recipe_folder):
+        """
+        :return: (base lockfile or None if conan can not create it, output)
+        """
+        lockfile = os.path.join(self.lock_folder, "{0}-{1}.base.lock".format(target, channel))
+        arguments = ["lock", "create", os.path.join(recipe_folder, "conanfile.py"), "--base",
+                     "--lockfile-out", lockfile] + self._profile_arguments(channel) + (["-u"] if self.update else [])
+        retcode, output, _ = self._run(arguments, channel)
+        return (lockfile if retcode == 0 and os.path.isfile(lockfile) else None), output
+
+    def _install(self, cell, base_lock):
+        """
+        Installs cell from base lockfile, or with settings and profile if there is no lockfile
+        :param base_lock: future of _base_lock result
+        :return: cell
+        """
+        lockfile, base_output = base_lock.result()
+        if not os.path.isdir(cell.install_folder):
+            os.makedirs(cell.install_folder)
+        outputs = []
+        start = time.time()
+        if lockfile:
+            cell_lock = os.path.join(self.lock_folder, "{0}-{1}-{2}.lock".format(cell.target, cell.channel,
+                                                                                 cell.build_type))
+            retcode, output, _ = self._run(["lock", "create", os.path.join(cell.recipe_folder, "conanfile.py"),
+                                            "--lockfile", lockfile, "--lockfile-out", cell_lock,
+                                            "-s", "build_type=" + cell.build_type] +
+                                           self._profile_arguments(cell.channel), cell.channel)
+            outputs.append(output)
+            if retcode == 0:
+                retcode, output, _ = self._run(["install", "-if", cell.install_folder, cell.recipe_folder,
+                                                "--build=never", "--lockfile", cell_lock], cell.channel)
+                outputs.append(output)
+        else:
+            outputs.append(base_output)
+            outputs.append("Base lockfile not created, installing without it\n")
+            retcode, output, _ = self._run(["install", "-if", cell.install_folder, cell.recipe_folder,
+                                            "--build=never", "-s", "build_type=" + cell.build_type] +
+                                           self._profile_arguments(cell.channel) + (["-u"] if self.update else []),
+                                           cell.channel)
+            outputs.append(output)
+        cell.retcode = retcode
+        cell.output = "".join(outputs)
+        cell.duration = time.time() - start
+        print("{0} {1} {2} {3} ({4:.1f}s)".format("OK    " if cell.retcode == 0 else "FAILED", cell.channel.upper(),
+                                                  cell.build_type, cell.target, cell.duration), flush=True)
+        if cell.retcode:
+            print(cell.output, flush=True)
+        return cell
+
+    def run(self, cells):
+        """
+        :param cells: list of Cell
+        :return: list of Cell with results
+        """
+        self.lock_folder = tempfile.mkdtemp(prefix="qtc_conan_locks_")
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                # Submitted before installs, so installs waiting for them never block the pool
+                base_locks = OrderedDict()
+                for cell in cells:
+                    key = (cell.target, cell.channel)
+                    if key not in base_locks:
+                        base_locks[key] = executor.submit(self._base_lock, cell.target, cell.channel,
+                                                          cell.recipe_folder)
+                return list(executor.map(lambda cell: self._install(cell, base_locks[(cell.target, cell.channel)]),
+                                         cells))
+        finally:
+            shutil.rmtree(self.lock_folder, ignore_errors=True)
+
+
+def make_cells(project_folder, install_folder, targets, channels, build_types):
+    """
+    :param install_folder: install folder pattern with {channel} and {build_type}, relative to project folder
+    :return: list of Cell, parts without conanfile.py are skipped
+    """
+    cells = []
+    for target in targets:
+        recipe_folder = os.path.join(project_folder, TARGETS[target]["folder"])
+        if not os.path.isfile(os.path.join(recipe_folder, "conanfile.py")):
+            print("No conanfile.py in {0}, {1} skipped".format(recipe_folder, target))
+            continue
+        for channel in channels:
+            for build_type in build_types:
+                folder = os.path.join(project_folder, install_folder.format(channel=channel, build_type=build_type),
+                                      TARGETS[target]["folder"])
+                cells.append(Cell(target, channel, build_type, recipe_folder, os.path.normpath(folder)))
+    return cells
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    generate_parser = subparsers.add_parser("generate", help="write Qt Creator external tools")
+    generate_parser.add_argument("--output", default=REPO_FOLDER, help="folder for 'Conan (Qt Creator ...)' folders")
+
+    install_parser = subparsers.add_parser("install", help="install project matrix concurrently")
+    install_parser.add_argument("project", help="project folder with conanfile.py")
+    install_parser.add_argument("-t", "--target", action="append", choices=list(TARGETS),
+                                help="project parts, default is all of them")
+    install_parser.add_argument("-c", "--channel", action="append", choices=list(CHANNELS),
+                                help="channels, default is all of them")
+    install_parser.add_argument("-b", "--build-type", action="append",
+                                help="build types, default is " + " and ".join(BUILD_TYPES))
+    install_parser.add_argument("-if", "--install-folder", default=os.path.join("build", "{channel}", "{build_type}"),
+                                help="install folder pattern relative to project, default is %(default)s")
+    install_parser.add_argument("-pr", "--profile", help="conan profile")
+    install_parser.add_argument("-j", "--jobs", type=int, help="installs running at once")
+    install_parser.add_argument("--no-update", action="store_true", help="do not check remotes for updates")
+    install_parser.add_argument("--conan", default=os.getenv("CONAN_EXECUTABLE", "conan"),
+                                help="conan executable, e.g. stub for testing")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        for path in generate(args.output):
+            print(os.path.relpath(path, args.output))
+        return 0
+
+    project_folder = os.path.abspath(args.project)
+    cells = make_cells(project_folder, args.install_folder, args.target or list(TARGETS),
+                       args.channel or list(CHANNELS), args.build_type or BUILD_TYPES)
+    if not cells:
+        print("Nothing to install")
+        return 1
+    matrix = InstallMatrix(args.conan, args.profile, args.jobs, update=not args.no_update)
+    start = time.time()
+    results = matrix.run(cells)
+    failed = [cell for cell in results if cell.retcode != 0]
+    print("Installed {0} of {1} in {2:.1f}s".format(len(results) - len(failed), len(results), time.time() - start))
+    for cell in results:
+        print("    {0:<6} {1:<4} {2:<8} {3:<12} {4}".format("OK" if cell.retcode == 0 else "FAILED",
+                                                             cell.channel.upper(), cell.build_type, cell.target,
+                                                             cell.install_folder))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())